@@ -1,7 +1,10 @@
 import asyncio
 import os
+from aioconsole import ainput
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
+
+from llm_core import LlmClient
+from voice_bot_http import close_openrouter_client
 
 load_dotenv()
 
@@ -12,13 +15,7 @@ class LanguageModelProcessor:
         if not openrouter_api_key:
             raise ValueError("OPENROUTER_API_KEY не найден в переменных окружения.")
 
-        self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=openrouter_api_key,
-        )
-        
         self.model = "meta-llama/llama-3.1-70b-instruct"
-        self.conversation_history = []
 
         # Загружаем системный промпт
         try:
@@ -26,39 +23,32 @@ class LanguageModelProcessor:
                 self.system_prompt = file.read().strip()
         except FileNotFoundError:
             raise FileNotFoundError("Файл 'Bot_prompt.txt' не найден.")
+        
+        # Общее ядро LLM: клиент, история со сводкой и кэш промпта
+        self.llm = LlmClient(self.model, self.system_prompt, max_tokens=1000)
+
+    @property
+    def conversation_history(self) -> list:
+        return self.llm.history
 
     async def process(self, text: str) -> str:
         """Обрабатывает входящий текст и возвращает ответ от LLM."""
-        messages = [{"role": "system", "content": self.system_prompt}]
-        
-        # Добавляем историю разговора
-        messages.extend(self.conversation_history)
-        
-        # Добавляем новое сообщение пользователя
-        messages.append({"role": "user", "content": text})
-        
+        parts = [delta async for delta in self.process_stream(text)]
+        return "".join(parts)
+
+    async def process_stream(self, text: str):
+        """Обрабатывает входящий текст и отдаёт ответ LLM по мере генерации."""
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            assistant_message = response.choices[0].message.content
-            
-            # Сохраняем в историю разговора
-            self.conversation_history.append({"role": "user", "content": text})
-            self.conversation_history.append({"role": "assistant", "content": assistant_message})
+            parts = []
+            async for content in self.llm.stream(text):
+                parts.append(content)
+                yield content
             
-            # Ограничиваем историю последними 20 сообщениями (10 пар)
-            if len(self.conversation_history) > 20:
-                self.conversation_history = self.conversation_history[-20:]
-            
-            return assistant_message
+            # Сохраняем в историю разговора, сжимаем старые ходы и применяем лимиты
+            await self.llm.commit_turn(text, "".join(parts))
             
         except Exception as e:
-            return f"Ошибка при обращении к API: {str(e)}"
+            yield f"Ошибка при обращении к API: {str(e)}"
 
 class ConversationManager:
     def __init__(self):
@@ -70,7 +60,8 @@ class ConversationManager:
     async def main(self):
         """Основной цикл разговора."""
         while True:
-            user_input = input("Вы: ").strip()
+            # Ждём ввод без блокировки event loop (keepalive и фоновые задачи продолжают работать)
+            user_input = (await ainput("Вы: ")).strip()
 
             if not user_input:
                 continue
@@ -80,12 +71,23 @@ class ConversationManager:
                 break
 
             try:
-                llm_response = await self.llm_processor.process(user_input)
-                print(f"🤖: {llm_response}")
+                # Печатаем ответ по мере генерации
+                print("🤖: ", end="", flush=True)
+                async for delta in self.llm_processor.process_stream(user_input):
+                    print(delta, end="", flush=True)
+                print()
                 print()
             except Exception as e:
                 print(f"❌ Error: {e}")
 
+        await close_openrouter_client()
+
 if __name__ == "__main__":
+    # uvloop ускоряет планировщик и сокетный I/O (недоступен на Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     manager = ConversationManager()
     asyncio.run(manager.main())
@@ -1,19 +1,36 @@
 import asyncio
+import json
 import os
-import shutil
-import subprocess
+import re
 import sys
 import time
-from typing import Optional
+from array import array
+from contextlib import aclosing
+from typing import Callable, Optional
 
 import requests
+import sounddevice as sd
 from dotenv import load_dotenv
 from deepgram import (DeepgramClient, DeepgramClientOptions, LiveOptions,
                      LiveTranscriptionEvents, Microphone)
-from openai import AsyncOpenAI
+
+from llm_core import LlmClient
+from voice_bot_http import close_openrouter_client
 
 load_dotenv()
 
+# Граница предложения для потоковой передачи ответа LLM в TTS
+SENTENCE_END_RE = re.compile(r'[.!?]\s')
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+# Управляющие сообщения Deepgram не меняются - сериализуем один раз
+_KEEPALIVE_MESSAGE = json.dumps({"type": "KeepAlive"})
+_FINALIZE_MESSAGE = json.dumps({"type": "Finalize"})
+
+def normalize_utterance(text: str) -> str:
+    """Нормализует фразу для сравнения гипотез STT (регистр и пунктуация не учитываются)."""
+    return ' '.join(_PUNCTUATION_RE.sub('', text.lower()).split())
+
 class Config:
     """Загружает и валидирует конфигурацию из переменных окружения."""
     def __init__(self):
@@ -38,13 +55,6 @@ class Config:
             raise ValueError("ОШИБКА: DEEPGRAM_API_KEY не установлен в переменных окружения.")
         if not os.path.exists(self.bot_prompt_file):
             raise FileNotFoundError(f"ОШИБКА: Файл промпта не найден: '{self.bot_prompt_file}'")
-        if not self._is_installed("ffplay"):
-            raise RuntimeError("ОШИБКА: ffplay не установлен. Установите ffmpeg для воспроизведения аудио.")
-
-    @staticmethod
-    def _is_installed(lib_name: str) -> bool:
-        """Проверяет доступность утилиты командной строки."""
-        return shutil.which(lib_name) is not None
 
 # --- Классы сервисов ---
 
@@ -55,18 +65,12 @@ class LiveTranscriber:
         self.client = DeepgramClient(config.deepgram_api_key, client_config)
         self.stt_model = config.stt_model
         self.transcript_future: Optional[asyncio.Future] = None
-
-    async def listen(self) -> str:
-        """
-        Слушает одно полное предложение с микрофона и возвращает его.
-        """
-        self.transcript_future = asyncio.Future()
         
-        connection = self.client.listen.asynclive.v("1")
-        connection.on(LiveTranscriptionEvents.Transcript, self._on_message)
-        connection.on(LiveTranscriptionEvents.Error, self._on_error)
-
-        options = LiveOptions(
+        # Постоянное соединение Deepgram, открывается заранее и переиспользуется между репликами
+        self._connection = None
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._needs_reconnect = False
+        self._options = LiveOptions(
             model=self.stt_model,
             language="en-US",
             punctuate=True,
@@ -79,32 +83,167 @@ class LiveTranscriber:
             vad_turnoff=250,  # Задержка перед отключением VAD
             utterance_end_ms=1500,  # Время тишины для завершения высказывания
         )
-        await connection.start(options)
         
-        microphone = Microphone(connection.send)
+        # Состояние текущего высказывания
+        self._fragments: list[str] = []
+        self._heard_speech = False
+        self._silence_ms = 0.0
+        self._finalize_sent = False
+        self._last_hypothesis: list[str] = []
+        
+        # Вызывается со стабильной промежуточной гипотезой (для спекулятивного запроса к LLM)
+        self.on_stable_interim: Optional[Callable[[str], None]] = None
+
+    SAMPLE_RATE = 16000
+    SILENCE_THRESHOLD = 500  # Пиковая амплитуда int16, ниже которой кадр считается тишиной
+    FINALIZE_SILENCE_MS = 300  # Тишина после речи, после которой просим Deepgram выдать финал
+    SPECULATION_MIN_WORDS = 3  # Минимальная длина стабильной гипотезы для спекуляции
+    KEEPALIVE_INTERVAL = 8.0  # Deepgram закрывает соединение после ~10с без данных
+
+    async def start(self):
+        """
+        Открывает соединение Deepgram заранее, чтобы не платить за WebSocket handshake на каждой реплике.
+        """
+        if self._connection is not None and not self._needs_reconnect:
+            return
+        await self.close()
+        
+        connection = self.client.listen.asynclive.v("1")
+        connection.on(LiveTranscriptionEvents.Transcript, self._on_message)
+        connection.on(LiveTranscriptionEvents.UtteranceEnd, self._on_utterance_end)
+        connection.on(LiveTranscriptionEvents.Error, self._on_error)
+        
+        if await connection.start(self._options) is False:
+            raise RuntimeError("Ошибка STT: не удалось подключиться к Deepgram")
+        
+        self._connection = connection
+        self._needs_reconnect = False
+        self._keepalive_task = asyncio.create_task(self._keepalive(connection))
+
+    async def _keepalive(self, connection):
+        """Держит соединение открытым, пока микрофон не передаёт аудио."""
+        try:
+            while True:
+                await asyncio.sleep(self.KEEPALIVE_INTERVAL)
+                await connection.send(_KEEPALIVE_MESSAGE)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Deepgram keepalive failed: {e}")
+            self._needs_reconnect = True
+
+    async def close(self):
+        """Закрывает постоянное соединение Deepgram."""
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        if self._connection is not None:
+            try:
+                await self._connection.finish()
+            except Exception as e:
+                print(f"⚠️ Deepgram close error: {e}")
+            self._connection = None
+
+    async def listen(self) -> str:
+        """
+        Слушает одно полное предложение с микрофона и возвращает его.
+        """
+        self.transcript_future = asyncio.Future()
+        self._fragments = []
+        self._heard_speech = False
+        self._silence_ms = 0.0
+        self._finalize_sent = False
+        self._last_hypothesis = []
+        
+        # Переиспользуем заранее открытое соединение (или переподключаемся после ошибки)
+        await self.start()
+        connection = self._connection
+        
+        async def push_audio(data: bytes):
+            await connection.send(data)
+            await self._detect_silence(connection, data)
+        
+        microphone = Microphone(push_audio)
         microphone.start()
 
         try:
             final_transcript = await self.transcript_future
             return final_transcript
         finally:
+            # Останавливаем только микрофон - соединение остаётся открытым для следующей реплики
             microphone.finish()
-            await connection.finish()
+
+    async def _detect_silence(self, connection, data: bytes):
+        """
+        Локальный детектор тишины: после FINALIZE_SILENCE_MS тишины вслед за речью
+        отправляет Deepgram сообщение Finalize, не дожидаясь серверного endpointing.
+        """
+        samples = array('h', data[:len(data) - len(data) % 2])
+        if not samples:
+            return
+        
+        peak = max(max(samples), -min(samples))
+        if peak >= self.SILENCE_THRESHOLD:
+            self._heard_speech = True
+            self._silence_ms = 0.0
+            self._finalize_sent = False
+        elif self._heard_speech and not self._finalize_sent:
+            self._silence_ms += len(samples) * 1000 / self.SAMPLE_RATE
+            if self._silence_ms >= self.FINALIZE_SILENCE_MS:
+                self._finalize_sent = True
+                await connection.send(_FINALIZE_MESSAGE)
+
+    def _resolve_transcript(self):
+        """Отдаёт накопленное высказывание ожидающему listen()."""
+        if not self._fragments:
+            return
+        
+        transcript = ' '.join(self._fragments)
+        self._fragments = []
+        
+        # Постобработка для исправления обрезанных первых слов
+        transcript = self._fix_truncated_transcript(transcript)
+        
+        if self.transcript_future and not self.transcript_future.done():
+            self.transcript_future.set_result(transcript)
+
+    def _check_stable_interim(self, interim: str):
+        """
+        LocalAgreement-2: если две последовательные гипотезы совпадают целиком
+        (и содержат не меньше SPECULATION_MIN_WORDS слов), считаем высказывание стабильным.
+        """
+        hypothesis = ' '.join(self._fragments + [interim]).split()
+        previous = self._last_hypothesis
+        self._last_hypothesis = hypothesis
+        
+        if (len(hypothesis) >= self.SPECULATION_MIN_WORDS
+                and normalize_utterance(' '.join(hypothesis)) == normalize_utterance(' '.join(previous))
+                and self.on_stable_interim):
+            self.on_stable_interim(self._fix_truncated_transcript(' '.join(hypothesis)))
 
     async def _on_message(self, _, result, **kwargs):
         """Обратный вызов для обработки сообщений транскрипции от Deepgram."""
-        if result.is_final and result.channel.alternatives[0].transcript.strip():
-            transcript = result.channel.alternatives[0].transcript.strip()
-            
-            # Постобработка для исправления обрезанных первых слов
-            transcript = self._fix_truncated_transcript(transcript)
-            
-            if self.transcript_future and not self.transcript_future.done():
-                self.transcript_future.set_result(transcript)
+        transcript = result.channel.alternatives[0].transcript.strip()
+        if not result.is_final:
+            if transcript:
+                self._check_stable_interim(transcript)
+            return
+        
+        if transcript:
+            self._fragments.append(transcript)
+        
+        # Конец речи по endpointing или ответ на наш Finalize - отдаём результат сразу
+        if result.speech_final or getattr(result, "from_finalize", False):
+            self._resolve_transcript()
+
+    async def _on_utterance_end(self, _, utterance_end, **kwargs):
+        """Обратный вызов UtteranceEnd: страховка, если speech_final не пришёл."""
+        self._resolve_transcript()
 
     async def _on_error(self, _, error, **kwargs):
         """Обратный вызов для обработки ошибок соединения."""
         print(f"\nSTT Error: {error}\n")
+        self._needs_reconnect = True
         if self.transcript_future and not self.transcript_future.done():
             self.transcript_future.set_exception(Exception(f"Ошибка STT: {error}"))
     
@@ -150,57 +289,145 @@ class LiveTranscriber:
 class LLMProcessor:
     """Управляет взаимодействием с языковой моделью через OpenRouter."""
     def __init__(self, config: Config):
-        self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=config.openrouter_api_key,
-        )
-        self.model = config.llm_model
-        self.conversation_history = []
-        
         # Загружаем системный промпт
         with open(config.bot_prompt_file, 'r', encoding='utf-8') as f:
             self.system_prompt = f.read().strip()
+        
+        # Общее ядро LLM: клиент, история с бюджетом токенов, сводка и кэш промпта (ключ проверен в Config)
+        self.llm = LlmClient(config.llm_model, self.system_prompt, max_tokens=500)  # Ограничиваем для голосового ответа
+        self.model = config.llm_model
+
+    @property
+    def conversation_history(self) -> list:
+        return self.llm.history
 
     async def generate_response(self, user_text: str) -> str:
         """Генерирует ответ от LLM на основе пользовательского ввода."""
-        start_time = time.time()
-        
-        messages = [{"role": "system", "content": self.system_prompt}]
+        sentences = [sentence async for sentence in self.generate_stream(user_text)]
+        return " ".join(sentences)
+
+    async def generate_stream(self, user_text: str, speculation: Optional["SpeculativeResponse"] = None):
+        """
+        Потоковая генерация ответа: отдаёт готовые предложения по мере их появления,
+        чтобы синтез речи начинался до окончания генерации.
         
-        # Добавляем историю разговора
-        messages.extend(self.conversation_history)
+        Если передан спекулятивный ответ, запущенный по той же фразе, используется он.
+        """
+        if speculation is not None:
+            if speculation.matches(user_text):
+                print("⚡ Using speculative LLM response")
+                async for sentence in speculation.sentences():
+                    yield sentence
+                if speculation.reply.get("text") is not None:
+                    await self._commit_turn(user_text, speculation.reply["text"], speculation.start_time)
+                return
+            speculation.cancel()
         
-        # Добавляем новое сообщение пользователя
-        messages.append({"role": "user", "content": user_text})
+        start_time = time.time()
+        reply = {}
+        async for sentence in self._stream_reply(user_text, reply):
+            yield sentence
+        if reply.get("text") is not None:
+            await self._commit_turn(user_text, reply["text"], start_time)
+
+    async def warmup(self):
+        """Прогревает соединение с OpenRouter и кэш промпта у провайдера."""
+        await self.llm.warmup()
+
+    def speculate(self, user_text: str) -> "SpeculativeResponse":
+        """Запускает спекулятивную генерацию по стабильной промежуточной гипотезе STT."""
+        return SpeculativeResponse(self, user_text)
+
+    async def _stream_reply(self, user_text: str, reply: dict):
+        """
+        Стримит ответ LLM по предложениям, не изменяя историю.
+        При успехе кладёт полный текст ответа в reply["text"].
+        """
+        start_time = time.time()
         
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500  # Ограничиваем для голосового ответа
-            )
-            
-            ai_response = response.choices[0].message.content
-            
-            # Сохраняем в историю разговора
-            self.conversation_history.append({"role": "user", "content": user_text})
-            self.conversation_history.append({"role": "assistant", "content": ai_response})
-            
-            # Ограничиваем историю последними 20 сообщениями (10 пар)
-            if len(self.conversation_history) > 20:
-                self.conversation_history = self.conversation_history[-20:]
+            # aclosing закрывает HTTP-ответ и при отмене спекулятивного запроса
+            async with aclosing(self.llm.stream(user_text)) as deltas:
+                parts = []
+                buffer = ""
+                first_sentence_logged = False
+                async for content in deltas:
+                    parts.append(content)
+                    # Ищем границу только в новом тексте (плюс один символ перед ним - граница
+                    # состоит из двух символов), а не сканируем весь буфер на каждой дельте
+                    scan_from = max(0, len(buffer) - 1)
+                    buffer += content
+                    
+                    # Отдаём все завершённые предложения из буфера
+                    while True:
+                        match = SENTENCE_END_RE.search(buffer, scan_from)
+                        if not match:
+                            break
+                        sentence = buffer[:match.end()].strip()
+                        buffer = buffer[match.end():]
+                        scan_from = 0
+                        if sentence:
+                            if not first_sentence_logged:
+                                elapsed_ms = int((time.time() - start_time) * 1000)
+                                print(f"LLM first sentence ({elapsed_ms}ms)")
+                                first_sentence_logged = True
+                            yield sentence
             
-            end_time = time.time()
-            elapsed_ms = int((end_time - start_time) * 1000)
+            # Остаток без завершающего знака препинания
+            if buffer.strip():
+                yield buffer.strip()
             
-            print(f"LLM ({elapsed_ms}ms): {ai_response}")
-            return ai_response
+            reply["text"] = "".join(parts)
             
         except Exception as e:
             error_msg = f"Ошибка при обращении к LLM: {str(e)}"
             print(error_msg)
-            return "Извините, произошла ошибка при обработке вашего запроса."
+            yield "Извините, произошла ошибка при обработке вашего запроса."
+
+    async def _commit_turn(self, user_text: str, ai_response: str, start_time: float):
+        """Сохраняет завершённый ход в историю разговора."""
+        # Сохраняем в историю, сжимаем старые ходы в сводку и применяем лимиты сообщений и токенов
+        await self.llm.commit_turn(user_text, ai_response)
+        
+        end_time = time.time()
+        elapsed_ms = int((end_time - start_time) * 1000)
+        
+        print(f"LLM ({elapsed_ms}ms): {ai_response}")
+
+class SpeculativeResponse:
+    """
+    Ответ LLM, запущенный по промежуточной гипотезе STT до получения финального транскрипта.
+    Предложения буферизуются и отдаются, только если финальная фраза совпала с гипотезой.
+    """
+    def __init__(self, processor: LLMProcessor, user_text: str):
+        self.user_text = user_text
+        self.start_time = time.time()
+        self.reply: dict = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(processor))
+
+    async def _run(self, processor: LLMProcessor):
+        try:
+            async for sentence in processor._stream_reply(self.user_text, self.reply):
+                await self._queue.put(sentence)
+        finally:
+            await self._queue.put(None)
+
+    def matches(self, user_text: str) -> bool:
+        """Проверяет, что финальная фраза совпадает с гипотезой спекуляции."""
+        return normalize_utterance(user_text) == normalize_utterance(self.user_text)
+
+    async def sentences(self):
+        """Отдаёт буферизованные и последующие предложения спекулятивного ответа."""
+        while True:
+            sentence = await self._queue.get()
+            if sentence is None:
+                break
+            yield sentence
+
+    def cancel(self):
+        """Отменяет спекулятивный запрос."""
+        self._task.cancel()
 
 class SpeechSynthesizer:
     """Обрабатывает преобразование текста в речь с помощью AWS Polly."""
@@ -233,7 +460,9 @@ class SpeechSynthesizer:
         self.tts = None
         self.api_key = config.deepgram_api_key
         self.model_name = config.tts_model
-        self.api_url = f"https://api.deepgram.com/v1/speak?model={self.model_name}&encoding=linear16&sample_rate=24000"
+        self.api_url = f"https://api.deepgram.com/v1/speak?model={self.model_name}&encoding=linear16&sample_rate=24000&container=none"
+        self._fallback_stream = sd.RawOutputStream(samplerate=24000, channels=1, dtype='int16')
+        self._fallback_stream.start()
 
     async def speak(self, text: str):
         """Преобразует текст в речь и воспроизводит."""
@@ -244,19 +473,37 @@ class SpeechSynthesizer:
             # Fallback на Deepgram
             await self._speak_deepgram(text)
 
+    def start_stream(self):
+        """Начинает потоковое озвучивание ответа по предложениям."""
+        if self.tts:
+            self.tts.start_stream()
+
+    async def enqueue(self, sentence: str):
+        """Добавляет готовое предложение в поток озвучивания."""
+        if self.tts:
+            await self.tts.enqueue(sentence)
+        else:
+            # Deepgram fallback озвучивает предложения последовательно
+            await self._speak_deepgram(sentence)
+
+    async def finish_stream(self):
+        """Дожидается окончания озвучивания всех предложений."""
+        if self.tts:
+            await self.tts.finish_stream()
+
+    async def warmup(self):
+        """Прогревает клиент TTS до первой реплики."""
+        if self.tts:
+            try:
+                await self.tts.warmup()
+            except Exception as e:
+                print(f"⚠️ TTS warmup failed: {e}")
+
     async def _speak_deepgram(self, text: str):
         """Fallback метод с Deepgram TTS."""
         headers = {"Authorization": f"Token {self.api_key}", "Content-Type": "application/json"}
         payload = {"text": text}
         
-        player_command = ["ffplay", "-autoexit", "-", "-nodisp", "-loglevel", "quiet"]
-        player_process = subprocess.Popen(
-            player_command,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-
         request_start_time = time.time()
         
         try:
@@ -264,20 +511,20 @@ class SpeechSynthesizer:
             with requests.post(self.api_url, stream=True, headers=headers, json=payload, timeout=20) as response:
                 response.raise_for_status()
                 first_byte_received = False
+                remainder = b""
                 for chunk in response.iter_content(chunk_size=1024):
                     if chunk:
                         if not first_byte_received:
                             ttfb = int((time.time() - request_start_time) * 1000)
                             print(f"TTS TTFB: {ttfb}ms")
                             first_byte_received = True
-                        player_process.stdin.write(chunk)
-                        player_process.stdin.flush()
+                        # Сырой linear16 пишем в постоянный поток целыми сэмплами
+                        chunk = remainder + chunk
+                        usable = len(chunk) - len(chunk) % 2
+                        remainder = chunk[usable:]
+                        self._fallback_stream.write(chunk[:usable])
         except Exception as e:
             print(f"Deepgram TTS error: {e}")
-        finally:
-            if player_process.stdin:
-                player_process.stdin.close()
-            player_process.wait()
 
 # --- Главный оркестратор приложения ---
 
@@ -297,6 +544,31 @@ class VoiceAssistant:
         self.llm_processor = LLMProcessor(config)
         self.synthesizer = SpeechSynthesizer(config)
         self.timeout_task = None
+        
+        # Спекулятивный ответ LLM по стабильной промежуточной гипотезе STT
+        self.speculation: Optional[SpeculativeResponse] = None
+        self.transcriber.on_stable_interim = self._on_stable_interim
+        
+        # Прогрев LLM и TTS в фоне: холодный TLS и старт провайдера не попадают в первый ход
+        self._warmup_task = asyncio.create_task(self._warmup())
+
+    async def _warmup(self):
+        """Параллельно прогревает LLM и TTS."""
+        await asyncio.gather(self.llm_processor.warmup(), self.synthesizer.warmup())
+
+    def _on_stable_interim(self, text: str):
+        """Запускает спекулятивный запрос к LLM, пока пользователь договаривает."""
+        if self.speculation is not None:
+            if self.speculation.matches(text):
+                return
+            self.speculation.cancel()
+        print(f"⚡ Speculating on: {text}")
+        self.speculation = self.llm_processor.speculate(text)
+
+    def _take_speculation(self) -> Optional[SpeculativeResponse]:
+        """Забирает текущую спекуляцию (она используется не более одного раза)."""
+        speculation, self.speculation = self.speculation, None
+        return speculation
 
     async def start_timeout(self):
         """Запускает таймер ожидания ответа пользователя (5 секунд)"""
@@ -353,23 +625,43 @@ class VoiceAssistant:
         print("--- 🎤 Voice Assistant Activated ---")
         print(f"Say any of these phrases to exit: {', '.join(self.TERMINATION_PHRASES)}")
         
+        # Открываем соединение Deepgram заранее, пока звучит приветствие
+        stt_warmup = asyncio.create_task(self.transcriber.start())
+        
         # Начальное приветствие
         greeting = "Hello! I'm Sarah Mitchell from Google HR. Let's discuss the Frontend Developer position in Warsaw. Which JavaScript framework do you use most often?"
         print(f"🤖 AI: {greeting}")
         await self.synthesizer.speak(greeting)
         
+        try:
+            await stt_warmup
+        except Exception as e:
+            print(f"⚠️ STT warmup failed, will retry on listen: {e}")
+        
+        try:
+            await self._conversation_loop()
+        finally:
+            await self.transcriber.close()
+
+    async def _conversation_loop(self):
+        """Цикл слушания и ответов до фразы завершения."""
         while True:
             try:
                 print("\n🎧 Listening...")
                 user_text = await self.listen_with_timeout()
+                speculation = self._take_speculation()
                 
                 if not user_text:
+                    if speculation:
+                        speculation.cancel()
                     continue
                     
                 print(f"👤 Human: {user_text}")
 
                 # Check for termination phrases
                 if any(phrase in user_text.lower().strip() for phrase in self.TERMINATION_PHRASES):
+                    if speculation:
+                        speculation.cancel()
                     await self.cancel_timeout()
                     print("Termination phrase detected. Shutting down.")
                     goodbye_message = "Goodbye! Have a great day!"
@@ -377,11 +669,19 @@ class VoiceAssistant:
                     await self.synthesizer.speak(goodbye_message)
                     break
 
-                ai_response = await self.llm_processor.generate_response(user_text)
-                await self.synthesizer.speak(ai_response)
+                # Озвучиваем ответ по предложениям, пока LLM продолжает генерацию
+                self.synthesizer.start_stream()
+                try:
+                    async for sentence in self.llm_processor.generate_stream(user_text, speculation):
+                        await self.synthesizer.enqueue(sentence)
+                finally:
+                    await self.synthesizer.finish_stream()
                 
             except Exception as e:
                 await self.cancel_timeout()
+                speculation = self._take_speculation()
+                if speculation:
+                    speculation.cancel()
                 print(f"Error in main loop: {e}")
                 print("Restarting listening loop...")
                 await asyncio.sleep(1)
@@ -400,6 +700,14 @@ async def main():
     except Exception as e:
         print(f"Unexpected critical error: {e}")
         sys.exit(1)
+    finally:
+        await close_openrouter_client()
 
 if __name__ == "__main__":
+    # uvloop ускоряет планировщик и сокетный I/O (недоступен на Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(main())
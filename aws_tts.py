@@ -1,11 +1,11 @@
 import asyncio
 import re
-import subprocess
 import time
-from typing import List, Optional
-import io
+from typing import AsyncIterator, Iterator, List, Optional
+from xml.sax.saxutils import escape
 import os
 
+import aioboto3
 import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
 from dotenv import load_dotenv
@@ -13,6 +13,9 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Граница предложения: пробелы после знака конца предложения
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+
 
 class AWSPollyTTS:
     """AWS Polly TTS с chunking и асинхронной обработкой."""
@@ -33,7 +36,17 @@ class AWSPollyTTS:
         self.voice_id = voice_id or os.getenv("AWS_POLLY_VOICE_ID", "Ruth")
         self.engine = engine or os.getenv("AWS_POLLY_ENGINE", "generative")
         self.chunk_size = chunk_size
+        self.sample_rate = 16000  # Частота PCM для локального воспроизведения
         region_name = region_name or os.getenv("AWS_DEFAULT_REGION", "us-east-1")
+        self.region_name = region_name
+        
+        # Асинхронный клиент Polly (aioboto3) с постоянным пулом соединений, создаётся лениво в event loop
+        self._session = aioboto3.Session()
+        self._async_polly = None
+        self._async_polly_ctx = None
+        self._async_polly_lock = asyncio.Lock()
+        # Ограничиваем число одновременных запросов к Polly
+        self._synthesis_semaphore = asyncio.Semaphore(4)
         
         try:
             self.polly_client = boto3.client('polly', region_name=region_name)
@@ -46,111 +59,202 @@ class AWSPollyTTS:
             print("   or set environment variables:")
             print("   AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY")
             raise
+        
+        # Постоянный аудиопоток sounddevice для бесшовного воспроизведения (открывается при первом использовании,
+        # чтобы API сервер без звуковой карты не требовал PortAudio)
+        self._player_stream = None
+        # Момент, когда закончится воспроизведение уже записанного в плеер аудио
+        self._playback_deadline = 0.0
+        self._pcm_remainder = b''
     
     def split_text_into_chunks(self, text: str) -> List[str]:
         """
         Разбивает текст на чанки по предложениям.
         """
-        # Разбиваем по предложениям (учитываем русский и английский)
-        sentences = re.split(r'[.!?]+\s*', text.strip())
-        sentences = [s.strip() for s in sentences if s.strip()]
+        return list(self.iter_text_chunks(text))
+    
+    def iter_text_chunks(self, text: str) -> Iterator[str]:
+        """
+        Однопроходный генератор чанков: первое предложение отдаётся сразу,
+        чтобы синтез начинался, пока остальной текст ещё разбивается.
+        """
+        # Короткий текст (обычно одно предложение от LLM) отдаём целиком без регулярки
+        if len(text) <= self.chunk_size:
+            text = text.strip()
+            if text:
+                yield text
+            return
         
-        chunks = []
-        current_chunk = ""
+        buf: List[str] = []
+        buf_len = 0
+        first_emitted = False
         
-        for sentence in sentences:
-            # Если предложение само по себе слишком длинное
+        # Разбиваем по предложениям (учитываем русский и английский), сохраняя знаки препинания
+        for sentence in _SENTENCE_SPLIT_RE.split(text.strip()):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            
             if len(sentence) > self.chunk_size:
-                # Добавляем текущий чанк если он есть
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = ""
-                
                 # Разбиваем длинное предложение по запятым
                 parts = sentence.split(', ')
-                for part in parts:
-                    if len(current_chunk + part) > self.chunk_size:
-                        if current_chunk:
-                            chunks.append(current_chunk.strip())
-                        current_chunk = part + ", "
-                    else:
-                        current_chunk += part + ", "
+                pieces = [part + ',' for part in parts[:-1]] + [parts[-1]]
             else:
-                # Проверяем поместится ли предложение в текущий чанк
-                if len(current_chunk + sentence) > self.chunk_size:
-                    if current_chunk:
-                        chunks.append(current_chunk.strip())
-                    current_chunk = sentence + ". "
-                else:
-                    current_chunk += sentence + ". "
+                pieces = [sentence]
+            
+            for piece in pieces:
+                piece_len = len(piece) + 1  # +1 на разделитель
+                # Проверяем поместится ли фрагмент в текущий чанк
+                if buf and buf_len + piece_len > self.chunk_size:
+                    yield ' '.join(buf)
+                    buf = []
+                    buf_len = 0
+                buf.append(piece)
+                buf_len += piece_len
+            
+            # Первое предложение отдаём немедленно
+            if not first_emitted and buf:
+                yield ' '.join(buf)
+                buf = []
+                buf_len = 0
+                first_emitted = True
         
         # Добавляем последний чанк
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
-        
-        return chunks
+        if buf:
+            yield ' '.join(buf)
     
-    async def synthesize_chunk(self, text: str) -> Optional[bytes]:
+    async def _get_async_polly(self):
         """
-        Синтезирует один чанк текста в аудио.
+        Возвращает асинхронный клиент Polly, открывая его при первом обращении.
         """
-        try:
-            # Выполняем синтез в отдельном потоке чтобы не блокировать event loop
-            loop = asyncio.get_event_loop()
-            
+        if self._async_polly is None:
+            async with self._async_polly_lock:
+                if self._async_polly is None:
+                    self._async_polly_ctx = self._session.client('polly', region_name=self.region_name)
+                    self._async_polly = await self._async_polly_ctx.__aenter__()
+        return self._async_polly
+    
+    async def warmup(self):
+        """
+        Прогревает асинхронный клиент Polly коротким синтезом (TLS и авторизация до первой реплики).
+        """
+        started = time.time()
+        if await self.synthesize_chunk('.', output_format='pcm') is not None:
+            print(f"🔥 Polly warmed up in {int((time.time() - started) * 1000)}ms")
+    
+    async def aclose(self):
+        """Закрывает асинхронный клиент Polly."""
+        if self._async_polly_ctx is not None:
+            await self._async_polly_ctx.__aexit__(None, None, None)
+            self._async_polly_ctx = None
+            self._async_polly = None
+    
+    def _build_ssml(self, text: str, output_format: str) -> str:
+        """Оборачивает текст чанка в SSML; при бесшовном PCM воспроизведении добавляет паузу между предложениями."""
+        pause = '<break time="150ms"/>' if output_format == 'pcm' else ''
+        return f"<speak>{escape(text)}{pause}</speak>"
+    
+    async def stream_chunk(self, text: str, output_format: str = 'mp3', block_size: int = 4096) -> AsyncIterator[bytes]:
+        """
+        Синтезирует один чанк текста и отдаёт аудио блоками по мере получения от Polly,
+        не дожидаясь конца AudioStream.
+        
+        Args:
+            text: Текст чанка
+            output_format: 'mp3' для браузера или 'pcm' (16-bit mono) для локального плеера
+            block_size: Размер блока чтения в байтах
+        """
+        polly = await self._get_async_polly()
+        
+        params = {
+            'Text': self._build_ssml(text, output_format),
+            'TextType': 'ssml',
+            'OutputFormat': output_format,
+            'VoiceId': self.voice_id,
+        }
+        if output_format == 'pcm':
+            params['SampleRate'] = str(self.sample_rate)
+        
+        async with self._synthesis_semaphore:
             # Пробуем с выбранным движком
             try:
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: self.polly_client.synthesize_speech(
-                        Text=text,
-                        OutputFormat='mp3',
-                        VoiceId=self.voice_id,
-                        Engine=self.engine
-                    )
-                )
+                response = await polly.synthesize_speech(**params, Engine=self.engine)
             except Exception as engine_error:
                 print(f"⚠️  Engine '{self.engine}' failed for voice '{self.voice_id}': {engine_error}")
                 print(f"🔄 Falling back to neural engine...")
                 
                 # Fallback к neural engine
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: self.polly_client.synthesize_speech(
-                        Text=text,
-                        OutputFormat='mp3',
-                        VoiceId=self.voice_id,
-                        Engine='neural'
-                    )
-                )
+                response = await polly.synthesize_speech(**params, Engine='neural')
             
-            # Читаем аудио данные
-            audio_data = response['AudioStream'].read()
-            return audio_data
+            stream = response['AudioStream']
+            try:
+                while True:
+                    block = await stream.read(block_size)
+                    if not block:
+                        break
+                    yield block
+            finally:
+                stream.close()
+    
+    async def synthesize_chunk(self, text: str, output_format: str = 'mp3') -> Optional[bytes]:
+        """
+        Синтезирует один чанк текста в аудио целиком.
+        
+        Args:
+            text: Текст чанка
+            output_format: 'mp3' для браузера или 'pcm' (16-bit mono) для локального плеера
+        """
+        try:
+            blocks = [block async for block in self.stream_chunk(text, output_format)]
+            return b''.join(blocks)
             
         except Exception as e:
             print(f"❌ Chunk synthesis error: {e}")
             return None
     
+    def _get_player(self):
+        """
+        Возвращает постоянный выходной поток sounddevice для сырого PCM (16-bit mono).
+        """
+        if self._player_stream is None:
+            import sounddevice as sd
+            
+            self._player_stream = sd.RawOutputStream(samplerate=self.sample_rate, channels=1, dtype='int16')
+            self._player_stream.start()
+        return self._player_stream
+    
     def play_audio_chunk(self, audio_data: bytes):
         """
-        Воспроизводит аудио чанк через ffplay.
+        Записывает PCM чанк в постоянный аудиопоток без пауз между чанками.
         """
         try:
-            player_command = ["ffplay", "-autoexit", "-", "-nodisp", "-loglevel", "quiet"]
-            player_process = subprocess.Popen(
-                player_command,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
+            # Поток принимает только целые сэмплы, нечётный хвост блока откладываем до следующей записи
+            audio_data = self._pcm_remainder + audio_data
+            usable = len(audio_data) - len(audio_data) % 2
+            self._pcm_remainder = audio_data[usable:]
+            if not usable:
+                return
             
-            player_process.stdin.write(audio_data)
-            player_process.stdin.close()
-            player_process.wait()
+            player_stream = self._get_player()
+            player_stream.write(audio_data[:usable])
+            
+            # Учитываем длительность записанного аудио (16-bit mono)
+            duration = usable / (self.sample_rate * 2)
+            self._playback_deadline = max(self._playback_deadline, time.time()) + duration
             
         except Exception as e:
             print(f"❌ Playback error: {e}")
+            self.close()
+    
+    def close(self):
+        """Закрывает аудиопоток плеера."""
+        if self._player_stream is not None:
+            try:
+                self._player_stream.stop()
+                self._player_stream.close()
+            except Exception:
+                pass
+            self._player_stream = None
     
     async def speak(self, text: str):
         """
@@ -159,69 +263,125 @@ class AWSPollyTTS:
         if not text.strip():
             return
         
-        start_time = time.time()
+        self.start_stream()
+        await self.enqueue(text)
+        await self.finish_stream()
+    
+    def start_stream(self):
+        """
+        Начинает потоковое воспроизведение: текст подаётся через enqueue() по мере
+        генерации, синтез и воспроизведение идут параллельно.
+        """
+        self._stream_start_time = time.time()
         
-        # Разбиваем текст на чанки
-        chunks = self.split_text_into_chunks(text)
-        print(f"🎤 Split into {len(chunks)} chunks")
+        # Очередь входящего текста (None - конец потока)
+        self._text_queue = asyncio.Queue()
         
         # Создаём очередь для аудио чанков
-        audio_queue = asyncio.Queue(maxsize=3)  # Буферизуем до 3 чанков
+        self._audio_queue = asyncio.Queue(maxsize=8)  # Буферизуем до 8 чанков
         
         # Флаг завершения синтеза
-        synthesis_done = asyncio.Event()
-        
-        async def synthesizer():
-            """Корутин для синтеза чанков."""
-            try:
-                for i, chunk in enumerate(chunks):
-                    print(f"🔄 Synthesizing chunk {i+1}/{len(chunks)}: {chunk[:50]}...")
-                    audio_data = await self.synthesize_chunk(chunk)
-                    if audio_data:
-                        await audio_queue.put(audio_data)
-                    else:
-                        print(f"⚠️  Skipped chunk {i+1}")
-            except Exception as e:
-                print(f"❌ Synthesizer error: {e}")
-            finally:
-                synthesis_done.set()
-        
-        async def player():
-            """Корутин для воспроизведения чанков."""
-            try:
-                chunk_count = 0
-                while True:
-                    try:
-                        # Ждём следующий чанк с таймаутом
-                        audio_data = await asyncio.wait_for(audio_queue.get(), timeout=1.0)
-                        chunk_count += 1
-                        
-                        print(f"🔊 Playing chunk {chunk_count}")
-                        
-                        # Воспроизводим в отдельном потоке
-                        loop = asyncio.get_event_loop()
-                        await loop.run_in_executor(None, self.play_audio_chunk, audio_data)
-                        
-                        audio_queue.task_done()
-                        
-                    except asyncio.TimeoutError:
-                        # Если очередь пуста и синтез завершён - выходим
-                        if synthesis_done.is_set() and audio_queue.empty():
-                            break
-                        continue
-                        
-            except Exception as e:
-                print(f"❌ Player error: {e}")
+        self._synthesis_done = asyncio.Event()
+        self._chunk_total = 0
         
         # Запускаем синтез и воспроизведение параллельно
-        synthesis_task = asyncio.create_task(synthesizer())
-        playback_task = asyncio.create_task(player())
+        self._stream_tasks = [
+            asyncio.create_task(self._synthesizer()),
+            asyncio.create_task(self._player()),
+        ]
+    
+    async def enqueue(self, text: str):
+        """
+        Добавляет фрагмент текста (например, готовое предложение от LLM) в поток синтеза.
+        """
+        if text.strip():
+            await self._text_queue.put(text)
+    
+    async def finish_stream(self):
+        """
+        Завершает поток и ждёт окончания воспроизведения всех чанков.
+        """
+        await self._text_queue.put(None)
         
         # Ждём завершения обеих задач
-        await asyncio.gather(synthesis_task, playback_task)
+        await asyncio.gather(*self._stream_tasks)
+        
+        # Ждём, пока плеер доиграет уже переданное аудио
+        remaining = self._playback_deadline - time.time()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
         
-        total_time = time.time() - start_time
-        print(f"✅ TTS завершён за {total_time:.1f}с ({len(chunks)} чанков)")
+        total_time = time.time() - self._stream_start_time
+        print(f"✅ TTS завершён за {total_time:.1f}с ({self._chunk_total} чанков)")
+    
+    async def _synthesizer(self):
+        """Корутин для синтеза чанков."""
+        try:
+            while True:
+                text = await self._text_queue.get()
+                if text is None:
+                    break
+                
+                # Разбиваем текст на чанки по мере синтеза
+                for chunk in self.iter_text_chunks(text):
+                    self._chunk_total += 1
+                    print(f"🔄 Synthesizing chunk {self._chunk_total}: {chunk[:50]}...")
+                    # Запускаем синтез не дожидаясь предыдущих чанков (параллелизм ограничен семафором),
+                    # порядок воспроизведения сохраняется порядком задач в очереди
+                    blocks = asyncio.Queue()
+                    task = asyncio.create_task(self._pump_chunk(chunk, blocks))
+                    await self._audio_queue.put((self._chunk_total, blocks, task))
+        except Exception as e:
+            print(f"❌ Synthesizer error: {e}")
+        finally:
+            self._synthesis_done.set()
+    
+    async def _pump_chunk(self, text: str, blocks: asyncio.Queue):
+        """Перекладывает блоки PCM одного чанка в его очередь; None означает конец чанка."""
+        try:
+            async for block in self.stream_chunk(text, output_format='pcm'):
+                await blocks.put(block)
+        except Exception as e:
+            print(f"❌ Chunk synthesis error: {e}")
+        finally:
+            await blocks.put(None)
+    
+    async def _player(self):
+        """Корутин для воспроизведения чанков."""
+        try:
+            chunk_count = 0
+            while True:
+                try:
+                    # Ждём следующий чанк с таймаутом
+                    chunk_index, blocks, _task = await asyncio.wait_for(self._audio_queue.get(), timeout=1.0)
+                    
+                    # Пишем PCM блоки в RawOutputStream sounddevice сразу по приходу от Polly,
+                    # в отдельном потоке (запись блокируется только при полном буфере устройства)
+                    loop = asyncio.get_event_loop()
+                    played = False
+                    while True:
+                        block = await blocks.get()
+                        if block is None:
+                            break
+                        if not played:
+                            played = True
+                            chunk_count += 1
+                            print(f"🔊 Playing chunk {chunk_count}")
+                        await loop.run_in_executor(None, self.play_audio_chunk, block)
+                    
+                    if not played:
+                        print(f"⚠️  Skipped chunk {chunk_index}")
+                    
+                    self._audio_queue.task_done()
+                    
+                except asyncio.TimeoutError:
+                    # Если очередь пуста и синтез завершён - выходим
+                    if self._synthesis_done.is_set() and self._audio_queue.empty():
+                        break
+                    continue
+                    
+        except Exception as e:
+            print(f"❌ Player error: {e}")
 
 # Тестирование (если запускается напрямую)
 async def test_polly():
@@ -238,6 +398,8 @@ async def test_polly():
         
         print(f"🎤 Starting AWS Polly test with voice '{tts.voice_id}' using '{tts.engine}' engine...")
         await tts.speak(test_text)
+        tts.close()
+        await tts.aclose()
         print("🎉 Test completed!")
         
     except Exception as e:
@@ -1,147 +1,234 @@
-import os
 import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
+
+from llm_core import LlmClient
+from voice_bot_http import close_openrouter_client
 
 # Load environment variables (e.g., OPENROUTER_API_KEY)
 load_dotenv()
 
+# Кэш ответов по точному совпадению (модель, системный промпт, история, реплика пользователя),
+# общий для всех сессий: одинаковые ходы интервью не требуют повторного запроса к API
+_RESPONSE_CACHE: "OrderedDict[tuple, tuple[str, bool]]" = OrderedDict()
+_RESPONSE_CACHE_SIZE = 256
+
 class OpenRouterClient:
-    def __init__(self, model: str = "openai/gpt-4.1"):
+    _END_MARKER = "[INTERVIEW_END]"
+    _END_MARKER_LEN = len(_END_MARKER)
+
+    # Инструкции завершения интервью: неизменный текст, добавляемый к системному промпту
+    _COMPLETION_INSTRUCTIONS = """
+
+INTERVIEW COMPLETION INSTRUCTIONS:
+When you have finished asking all your interview questions and are ready to end the interview, you MUST include the special marker [INTERVIEW_END] at the very beginning of your final response.
+
+Example: "[INTERVIEW_END] Thank you for completing the screening interview. Our recruitment team will be in touch soon to discuss the next steps. Enjoy the rest of your day!"
+
+This marker will signal the system to automatically end the interview session.
+
+IMPORTANT: Also use [INTERVIEW_END] if the candidate explicitly asks to end the interview, says goodbye, or indicates they want to finish."""
+
+    def __init__(self, model: str = "openai/gpt-4.1", user_id: Optional[str] = None):
         """
         Инициализирует клиент OpenRouter с моделью по умолчанию.
+        
+        Args:
+            model: Модель OpenRouter
+            user_id: Идентификатор пользователя; его хэш передаётся в поле user,
+                     чтобы запросы сессии попадали в один кэш промптов провайдера
         """
-        self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=os.getenv("OPENROUTER_API_KEY"),
+        # Общее ядро LLM; история - последние 10 сообщений (5 пар), как и раньше без якоря и сводки
+        self.llm = LlmClient(
+            model,
+            max_tokens=500,
+            max_history_messages=10,
+            prompt_token_budget=None,
+            keep_anchor=False,
+            summarize=False,
+            user=hashlib.sha256(user_id.encode()).hexdigest()[:32] if user_id else None,
         )
         self.model = model
-        self.conversation_history = []
         self.interview_completed = False  # Флаг завершения интервью
+        
+        # Системные промпты с инструкциями завершения: исходный промпт -> готовый текст
+        self._system_cache: dict[str, str] = {}
+
+    @property
+    def conversation_history(self) -> list:
+        return self.llm.history
+
+    # Ответ, которым отвечаем после завершения интервью
+    _COMPLETED_MESSAGE = "Thank you for completing the screening interview. Our recruitment team will be in touch soon to discuss the next steps. Enjoy the rest of your day!"
 
-    async def chat_completion(self, user_message: str, system_message: str = None) -> tuple[str, bool]:
+    async def chat_completion(self, user_message: str, system_message: str = None,
+                              use_cache: bool = True) -> tuple[str, bool]:
         """
         Отправляет запрос к OpenRouter API и возвращает ответ с флагом завершения.
+        use_cache=False - всегда реальный запрос (проверка доступности API, приветствие интервью).
         Возвращает: (response_text, is_interview_ended)
         """
         # Проверяем, завершено ли интервью
         if self.interview_completed:
-            return "Thank you for completing the screening interview. Our recruitment team will be in touch soon to discuss the next steps. Enjoy the rest of your day!", True
+            return self._COMPLETED_MESSAGE, True
         
-        messages = []
+        cache_key = self._response_cache_key(user_message, system_message) if use_cache else None
+        if cache_key is not None:
+            cached = await self._use_cached_response(cache_key, user_message)
+            if cached is not None:
+                return cached
         
-        if system_message:
-            # Добавляем инструкции для метки завершения в системный промпт
-            enhanced_system_message = f"""{system_message}
+        reply = {}
+        parts = [content async for content in self._stream_turn(user_message, system_message, reply)]
+        if "error" in reply:
+            return f"Ошибка при обращении к API: {reply['error']}", False
+        
+        result = ("".join(parts), reply["ended"])
+        if cache_key is not None:
+            self._store_cached_response(cache_key, result)
+        return result
 
-INTERVIEW COMPLETION INSTRUCTIONS:
-When you have finished asking all your interview questions and are ready to end the interview, you MUST include the special marker [INTERVIEW_END] at the very beginning of your final response.
+    async def _use_cached_response(self, cache_key: tuple, user_message: str) -> Optional[tuple[str, bool]]:
+        """Возвращает ответ из кэша и сохраняет ход в историю, как при обычном запросе."""
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is None:
+            return None
+        _RESPONSE_CACHE.move_to_end(cache_key)
+        assistant_message, interview_ended = cached
+        print("⚡ Response cache hit")
+        if interview_ended:
+            self.interview_completed = True
+        await self.llm.commit_turn(user_message, assistant_message)
+        return cached
 
-Example: "[INTERVIEW_END] Thank you for completing the screening interview. Our recruitment team will be in touch soon to discuss the next steps. Enjoy the rest of your day!"
+    @staticmethod
+    def _store_cached_response(cache_key: tuple, result: tuple[str, bool]):
+        """Кладёт ответ в кэш, вытесняя самый старый."""
+        _RESPONSE_CACHE[cache_key] = result
+        if len(_RESPONSE_CACHE) > _RESPONSE_CACHE_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
 
-This marker will signal the system to automatically end the interview session.
+    def _response_cache_key(self, user_message: str, system_message: Optional[str]) -> tuple:
+        """Ключ кэша ответов: модель, хэш системного промпта, история и нормализованная реплика."""
+        system_digest = hashlib.blake2b(system_message.encode()).digest() if system_message else b""
+        history = tuple((m["role"], m["content"]) for m in self.conversation_history)
+        return (self.model, system_digest, history, user_message.strip().lower())
 
-IMPORTANT: Also use [INTERVIEW_END] if the candidate explicitly asks to end the interview, says goodbye, or indicates they want to finish."""
-            messages.append({"role": "system", "content": enhanced_system_message})
-        
-        # Добавляем историю разговора
-        messages.extend(self.conversation_history)
+    async def stream_completion(self, user_message: str, system_message: str = None):
+        """
+        Потоковая генерация ответа (метка завершения вырезается, флаг - is_interview_completed()).
+        Использует тот же кэш ответов, что и chat_completion: ответ из кэша отдаётся одним куском.
+        """
+        if self.interview_completed:
+            yield self._COMPLETED_MESSAGE
+            return
         
-        # Добавляем новое сообщение пользователя
-        messages.append({"role": "user", "content": user_message})
+        cache_key = self._response_cache_key(user_message, system_message)
+        cached = await self._use_cached_response(cache_key, user_message)
+        if cached is not None:
+            yield cached[0]
+            return
         
-        try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500
-            )
-            
-            assistant_message = response.choices[0].message.content
-            
-            # Проверяем наличие метки завершения интервью
-            interview_ended = False
-            if assistant_message.startswith("[INTERVIEW_END]"):
-                interview_ended = True
-                self.interview_completed = True
-                # Убираем метку из сообщения для пользователя
-                assistant_message = assistant_message.replace("[INTERVIEW_END]", "").strip()
-                print("🎯 Interview completion marker detected!")
-            
-            # Дополнительная проверка на ключевые фразы завершения
-            elif not self.interview_completed:
-                completion_phrases = [
-                    "thank you for completing the screening interview",
-                    "our recruitment team will be in touch",
-                    "enjoy the rest of your day",
-                    "we'll contact you",
-                    "thank you for your time",
-                    "we'll be in touch soon"
-                ]
-                
-                assistant_lower = assistant_message.lower()
-                if any(phrase in assistant_lower for phrase in completion_phrases):
-                    # Проверяем, что это действительно завершающее сообщение
-                    if len(assistant_message) < 200 and ("thank you" in assistant_lower or "contact" in assistant_lower):
-                        interview_ended = True
-                        self.interview_completed = True
-                        print("🎯 Interview completion detected by key phrases!")
-            
-            # Сохраняем в историю разговора
-            self.conversation_history.append({"role": "user", "content": user_message})
-            self.conversation_history.append({"role": "assistant", "content": assistant_message})
-            
-            # Ограничиваем историю последними 10 сообщениями (5 пар)
-            if len(self.conversation_history) > 10:
-                self.conversation_history = self.conversation_history[-10:]
-            
-            return assistant_message, interview_ended
-            
-        except Exception as e:
-            return f"Ошибка при обращении к API: {str(e)}", False
+        reply = {}
+        async for content in self._stream_turn(user_message, system_message, reply):
+            yield content
+        if "error" in reply:
+            yield f"Ошибка при обращении к API: {reply['error']}"
+            return
+        self._store_cached_response(cache_key, (reply["text"], reply["ended"]))
 
-    async def stream_completion(self, user_message: str, system_message: str = None):
+    async def _stream_turn(self, user_message: str, system_message: Optional[str], reply: dict):
         """
-        Потоковая генерация ответа.
+        Единый потоковый путь для обоих методов: отдаёт текст ответа без метки [INTERVIEW_END],
+        определяя метку по первым символам, пока остальной ответ ещё генерируется.
+        Кладёт в reply "text" и "ended", при ошибке - "error".
         """
-        messages = []
-        
         if system_message:
-            messages.append({"role": "system", "content": system_message})
+            # Добавляем инструкции для метки завершения в системный промпт; системное сообщение
+            # пересобирается только при смене промпта, и префикс запроса остаётся байт-в-байт одинаковым
+            enhanced_system_message = self._system_cache.get(system_message)
+            if enhanced_system_message is None:
+                enhanced_system_message = system_message + self._COMPLETION_INSTRUCTIONS
+                # Храним только текущий промпт: после повторной загрузки CV старый больше не нужен
+                self._system_cache = {system_message: enhanced_system_message}
+            self.llm.set_system_prompt(enhanced_system_message)
+        else:
+            self.llm.set_system_prompt(None)
         
-        messages.extend(self.conversation_history)
-        messages.append({"role": "user", "content": user_message})
+        interview_ended = False
+        parts = []
+        head = ""  # Начало ответа, пока не ясно, есть ли в нём метка
+        decided = False
+        strip_leading = False  # После метки пропускаем пробелы до начала текста
         
         try:
-            stream = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500,
-                stream=True
-            )
-            
-            assistant_message = ""
-            async for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    content = chunk.choices[0].delta.content
-                    assistant_message += content
-                    yield content
+            async for content in self.llm.stream(user_message):
+                if not decided:
+                    head += content
+                    if len(head) < self._END_MARKER_LEN and self._END_MARKER.startswith(head):
+                        continue
+                    decided = True
+                    if head[:self._END_MARKER_LEN] == self._END_MARKER:
+                        # Метка в начале ответа - интервью завершается, не дожидаясь конца генерации
+                        interview_ended = True
+                        self.interview_completed = True
+                        print("🎯 Interview completion marker detected!")
+                        content = head[self._END_MARKER_LEN:]
+                        strip_leading = True
+                    else:
+                        content = head
+                
+                if strip_leading:
+                    content = content.lstrip()
+                    if not content:
+                        continue
+                    strip_leading = False
+                
+                parts.append(content)
+                yield content
             
-            # Сохраняем полный ответ в историю
-            self.conversation_history.append({"role": "user", "content": user_message})
-            self.conversation_history.append({"role": "assistant", "content": assistant_message})
+            # Короткий ответ, целиком похожий на начало метки
+            if not decided and head:
+                parts.append(head)
+                yield head
             
-            if len(self.conversation_history) > 10:
-                self.conversation_history = self.conversation_history[-10:]
-                
         except Exception as e:
-            yield f"Ошибка при обращении к API: {str(e)}"
+            reply["error"] = str(e)
+            return
+        
+        assistant_message = "".join(parts)
+        
+        # Дополнительная проверка на ключевые фразы завершения
+        if not interview_ended and not self.interview_completed:
+            completion_phrases = [
+                "thank you for completing the screening interview",
+                "our recruitment team will be in touch",
+                "enjoy the rest of your day",
+                "we'll contact you",
+                "thank you for your time",
+                "we'll be in touch soon"
+            ]
+            
+            assistant_lower = assistant_message.lower()
+            if any(phrase in assistant_lower for phrase in completion_phrases):
+                # Проверяем, что это действительно завершающее сообщение
+                if len(assistant_message) < 200 and ("thank you" in assistant_lower or "contact" in assistant_lower):
+                    interview_ended = True
+                    self.interview_completed = True
+                    print("🎯 Interview completion detected by key phrases!")
+        
+        # Сохраняем в историю разговора (последние 10 сообщений)
+        await self.llm.commit_turn(user_message, assistant_message)
+        
+        reply["text"] = assistant_message
+        reply["ended"] = interview_ended
 
     def clear_history(self):
         """Очищает историю разговора."""
-        self.conversation_history = []
+        self.llm.clear_history()
         self.interview_completed = False
     
     def is_interview_completed(self) -> bool:
@@ -164,8 +251,11 @@ async def run_batch_example():
     
     system_prompt = "Ты полезный AI-ассистент, который отвечает лаконично и по делу."
     
-    response = await client.chat_completion(user_input, system_prompt)
-    print(f"\nResponse: {response}")
+    try:
+        response = await client.chat_completion(user_input, system_prompt)
+        print(f"\nResponse: {response}")
+    finally:
+        await close_openrouter_client()
 
 
 
@@ -0,0 +1,290 @@
+import re
+import time
+from collections import deque
+from typing import AsyncIterator, Optional, Union
+
+from voice_bot_http import get_openrouter_client, with_cache_breakpoints
+
+# Серии пустых строк в репликах сжимаем до одной пустой строки
+_NEWLINE_RUN_RE = re.compile(r'\n{3,}')
+
+
+def _clean_content(text: str) -> str:
+    """Убирает пробелы по краям и лишние переводы строк."""
+    return _NEWLINE_RUN_RE.sub('\n\n', text.strip())
+
+
+class LlmClient:
+    """
+    Общее ядро работы с LLM для всех точек входа (голосовой бот, чат, WebSocket API):
+    общий клиент OpenRouter (aiohttp или httpx с HTTP/2), неизменный системный префикс, история с лимитом
+    сообщений и токенов, сжатие старых ходов в сводку, точки кэширования промпта,
+    потоковый и обычный запросы и прогрев.
+    """
+    # Сжатие истории: старые пары заменяются короткой сводкой от дешёвой модели
+    SUMMARY_MODEL = "meta-llama/llama-3.1-8b-instruct"
+    SUMMARY_THRESHOLD = 12  # Сообщений в истории, после которых начинаем сжатие
+    SUMMARY_PAIRS = 3  # Сколько старых пар сжимаем за раз
+    SUMMARY_EVERY_TURNS = 3  # Минимум ходов между сжатиями
+    SUMMARY_PROMPT = "Summarize the conversation below in 80 tokens or fewer. Keep every important fact."
+
+    MIN_HISTORY_TOKENS = 1000
+
+    def __init__(
+        self,
+        model: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        max_history_messages: int = 20,
+        prompt_token_budget: Optional[int] = 4000,
+        keep_anchor: bool = True,
+        summarize: bool = True,
+        user: Optional[str] = None,
+    ):
+        """
+        Args:
+            model: Модель OpenRouter
+            system_prompt: Системный промпт (можно сменить позже через set_system_prompt)
+            max_tokens: Лимит токенов ответа
+            temperature: Температура генерации
+            max_history_messages: Максимум сообщений в истории
+            prompt_token_budget: Общий бюджет промпта в оценочных токенах (None - без ограничения)
+            keep_anchor: Никогда не вытеснять первую пару разговора
+            summarize: Сжимать старые пары в сводку
+            user: Стабильный идентификатор пользователя (поле user), чтобы запросы попадали в один кэш провайдера
+        """
+        # Общий для процесса клиент OpenRouter
+        self.client = get_openrouter_client()
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.max_history_messages = max_history_messages
+        self.prompt_token_budget = prompt_token_budget
+        self.keep_anchor = keep_anchor
+        self.summarize = summarize
+        self.user = user
+
+        # Простое скользящее окно (без якоря и сводки) - deque с автоматическим вытеснением
+        self._plain_window = not keep_anchor and not summarize
+        self.history: Union[list, deque] = deque(maxlen=max_history_messages) if self._plain_window else []
+
+        # Кэш оценок токенов для сообщений истории: id(message) -> количество токенов
+        self._token_cache: dict[int, int] = {}
+        self._running_tokens = 0
+
+        # Сводка вытесненных ходов (системное сообщение сразу после первой пары-якоря)
+        self._summary_message: Optional[dict] = None
+        self._turns_since_summary = 0
+
+        self.system_prompt: Optional[str] = None
+        self._system_msg: Optional[dict] = None
+        self._history_token_budget: Optional[int] = None
+        self.set_system_prompt(system_prompt)
+
+    def set_system_prompt(self, system_prompt: Optional[str]):
+        """
+        Задаёт системный промпт. Сообщение строится один раз: байт-в-байт одинаковый префикс запроса.
+        """
+        if self._system_msg is not None and system_prompt == self.system_prompt:
+            return
+        self.system_prompt = system_prompt
+        self._system_msg = {"role": "system", "content": system_prompt} if system_prompt else None
+
+        # Бюджет истории: общий размер промпта держим около prompt_token_budget токенов
+        if self.prompt_token_budget is None:
+            self._history_token_budget = None
+        else:
+            system_tokens = self._estimate(self._system_msg) if self._system_msg else 0
+            self._history_token_budget = max(self.MIN_HISTORY_TOKENS, self.prompt_token_budget - system_tokens)
+
+    @staticmethod
+    def _estimate(message: dict) -> int:
+        """Грубая оценка количества токенов в сообщении (~4 символа на токен)."""
+        return len(message["content"]) // 4 + 1
+
+    def _append_history(self, message: dict):
+        """Добавляет сообщение в историю и кэширует его оценку токенов."""
+        message["content"] = _clean_content(message["content"])
+        token_count = self._estimate(message)
+        if self._plain_window and len(self.history) == self.history.maxlen:
+            # deque сам вытеснит самое старое сообщение - убираем его из учёта заранее
+            self._forget(self.history[0])
+        self._token_cache[id(message)] = token_count
+        self._running_tokens += token_count
+        self.history.append(message)
+
+    def _forget(self, message: dict):
+        """Убирает сообщение из учёта токенов."""
+        self._running_tokens -= self._token_cache.pop(id(message), 0)
+
+    def _anchor_len(self) -> int:
+        """Длина якоря - первой пары разговора, которая никогда не вытесняется."""
+        return min(2, len(self.history)) if self.keep_anchor else 0
+
+    def _protected_prefix_len(self) -> int:
+        """Число защищённых сообщений в начале истории: якорь и сводка."""
+        return self._anchor_len() + (1 if self._summary_message is not None else 0)
+
+    def _trim_history(self):
+        """Вытесняет старые сообщения по лимиту сообщений и кэшированному лимиту токенов."""
+        if self._plain_window and self._history_token_budget is None:
+            return
+        prefix_len = self._protected_prefix_len()
+        while len(self.history) > prefix_len and (
+            len(self.history) > self.max_history_messages
+            or (self._history_token_budget is not None and self._running_tokens > self._history_token_budget)
+        ):
+            evicted = self.history[prefix_len]
+            del self.history[prefix_len]
+            self._forget(evicted)
+
+    async def _maybe_summarize(self):
+        """
+        Сжимает самые старые пары (после якоря) в одно системное сообщение-сводку.
+        Запускается не чаще чем раз в SUMMARY_EVERY_TURNS ходов, чтобы префикс
+        запроса оставался стабильным и кэшировался провайдером.
+        """
+        if not self.summarize:
+            return
+        self._turns_since_summary += 1
+        if (len(self.history) <= self.SUMMARY_THRESHOLD
+                or self._turns_since_summary < self.SUMMARY_EVERY_TURNS):
+            return
+
+        anchor_len = self._anchor_len()
+        start = self._protected_prefix_len()
+        end = start + self.SUMMARY_PAIRS * 2
+        dropped = self.history[start:end]
+        if not dropped:
+            return
+
+        dialogue = "\n".join(f"{m['role']}: {m['content']}" for m in dropped)
+        if self._summary_message is not None:
+            dialogue = f"{self._summary_message['content']}\n{dialogue}"
+
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": self.SUMMARY_PROMPT},
+                    {"role": "user", "content": dialogue},
+                ],
+                temperature=0.0,
+                max_tokens=120
+            )
+            summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"⚠️ History summarization failed: {e}")
+            return
+
+        for message in dropped:
+            self._forget(message)
+        if self._summary_message is not None:
+            self._forget(self._summary_message)
+
+        self._summary_message = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+        token_count = self._estimate(self._summary_message)
+        self._token_cache[id(self._summary_message)] = token_count
+        self._running_tokens += token_count
+
+        self.history = (
+            self.history[:anchor_len]
+            + [self._summary_message]
+            + self.history[end:]
+        )
+        self._turns_since_summary = 0
+        print(f"🗜️ Compressed {len(dropped)} history messages into summary")
+
+    def _prepare_messages(self) -> list:
+        """
+        Убирает из истории повторы перед отправкой: ход (вопрос пользователя и ответ на него),
+        за которым сразу следует точно такой же ход. Остаётся последний из повторов,
+        поэтому самый свежий ответ ассистента всегда уходит в запрос.
+        """
+        history = list(self.history)
+        prepared = []
+        i = 0
+        while i < len(history):
+            turn = history[i:i + 2]
+            if (len(turn) == 2 and turn[0]["role"] == "user" and turn[1]["role"] == "assistant"
+                    and history[i + 2:i + 4] == turn):
+                i += 2
+                continue
+            prepared.append(history[i])
+            i += 1
+        return prepared
+
+    def _request_options(self) -> dict:
+        """Дополнительные параметры запроса, одинаковые для всех вызовов сессии."""
+        return {"user": self.user} if self.user else {}
+
+    def build_messages(self, user_text: str) -> list:
+        """
+        Системный промпт, история разговора и новое сообщение пользователя;
+        стабильный префикс помечается для кэша промптов провайдера.
+        """
+        messages = [*self._prepare_messages(), {"role": "user", "content": _clean_content(user_text)}]
+        if self._system_msg is None:
+            return messages
+        return with_cache_breakpoints([self._system_msg, *messages])
+
+    async def stream(self, user_text: str) -> AsyncIterator[str]:
+        """
+        Стримит текстовые дельты ответа, не изменяя историю (см. commit_turn).
+        HTTP-ответ закрывается и при досрочном закрытии генератора.
+        """
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self.build_messages(user_text),
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            stream=True,
+            **self._request_options()
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+    async def complete(self, user_text: str) -> str:
+        """Возвращает полный ответ одним запросом, не изменяя историю."""
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self.build_messages(user_text),
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            **self._request_options()
+        )
+        return response.choices[0].message.content
+
+    async def commit_turn(self, user_text: str, reply: str):
+        """Сохраняет завершённый ход, сжимает старые ходы в сводку и применяет лимиты истории."""
+        self._append_history({"role": "user", "content": user_text})
+        self._append_history({"role": "assistant", "content": reply})
+        await self._maybe_summarize()
+        self._trim_history()
+
+    def clear_history(self):
+        """Очищает историю разговора и сводку."""
+        self.history.clear()
+        self._token_cache.clear()
+        self._running_tokens = 0
+        self._summary_message = None
+        self._turns_since_summary = 0
+
+    async def warmup(self):
+        """Прогревает соединение с OpenRouter и кэш промпта у провайдера запросом на 1 токен."""
+        started = time.time()
+        try:
+            await self.client.chat.completions.create(
+                model=self.model,
+                messages=self.build_messages("ok"),
+                max_tokens=1,
+                **self._request_options()
+            )
+            print(f"🔥 LLM warmed up in {int((time.time() - started) * 1000)}ms")
+        except Exception as e:
+            print(f"⚠️ LLM warmup failed: {e}")
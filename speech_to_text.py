@@ -1,6 +1,13 @@
 import asyncio
 import io
+import logging
 import os
+import re
+import wave
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
 from dotenv import load_dotenv
 from deepgram import (
     DeepgramClient,
@@ -14,21 +21,139 @@ from deepgram import (
 # Load environment variables (e.g., Deepgram API key from .env file)
 load_dotenv()
 
+# Горячий путь распознавания логирует через logging: при уровне INFO отладочные сообщения ничего не стоят
+logger = logging.getLogger(__name__)
+
+# Исправления распространённых ошибок распознавания коротких фраз
+_CORRECTIONS = {
+    # Распространенные ошибки в коротких ответах
+    'yeah': 'yes',
+    'yep': 'yes',
+    'nope': 'no',
+    'uh huh': 'yes',
+    'mm hmm': 'yes',
+    'uh uh': 'no',
+    # Исправления для технических терминов
+    'react': 'React',
+    'javascript': 'JavaScript',
+    'typescript': 'TypeScript',
+    'node': 'Node',
+    'angular': 'Angular',
+    'vue': 'Vue'
+}
+# Одна регулярка вместо цикла по словарю: все исправления за один проход
+_CORRECTION_RE = re.compile(r"\b(" + "|".join(map(re.escape, _CORRECTIONS)) + r")\b", re.IGNORECASE)
+
+# Исправления для обрезанных первых слов (обрезанный фрагмент -> полное слово)
+_TRUNCATION_FIXES = {
+    'eact': 'React',
+    'avaScript': 'JavaScript',
+    'ypeScript': 'TypeScript',
+    'ode': 'Node',
+    'ngular': 'Angular',
+    'ue': 'Vue'
+}
+_TRUNCATION_FIXES_LOWER = {k.lower(): v for k, v in _TRUNCATION_FIXES.items()}
+
+# Слова, завершающие сессию живой транскрипции (сравниваются целыми словами, без пунктуации)
+_STOP_WORDS = frozenset({"goodbye"})
+_WORD_RE = re.compile(r"\w+")
+
+# Улучшенные настройки для предзаписанного аудио (общие для всех экземпляров DeepgramSTT)
+_OPTS_STD = PrerecordedOptions(
+    model="nova-2",
+    punctuate=True,
+    language="en-US",
+    smart_format=True,
+    # Улучшения для коротких фраз и предотвращения обрезания первого слова
+    diarize=False,  # Отключаем диаризацию для лучшей производительности
+    utterances=True,  # Включаем разделение на высказывания
+    paragraphs=False,  # Отключаем для коротких фраз
+    detect_language=False,  # Отключаем автоопределение языка
+    # Настройки для улучшения качества и предотвращения обрезания
+    profanity_filter=False,
+    redact=False,
+    search=None,
+    replace=None,
+    keywords=None,
+    version="latest",
+    # Дополнительные настройки для лучшего захвата начала речи
+    multichannel=False,
+    alternatives=1,
+    numerals=True
+)
+
+# Альтернативные настройки для очень коротких фраз (используем nova-2 с другими параметрами)
+_OPTS_SHORT = PrerecordedOptions(
+    model="nova-2",
+    punctuate=True,
+    language="en-US",
+    smart_format=True,
+    utterances=True,
+    detect_language=False,
+    # Более мягкие настройки для коротких фраз чтобы не обрезать первое слово
+    filler_words=False,  # Убираем слова-паразиты
+    profanity_filter=False,
+    redact=False,
+    # Дополнительные настройки для лучшего захвата коротких фраз
+    multichannel=False,
+    alternatives=1,
+    numerals=True,
+    diarize=False
+)
+
+# Минимальные настройки для максимальной совместимости
+_OPTS_MIN = PrerecordedOptions(
+    model="nova-2",
+    language="en-US",
+    punctuate=True
+)
+
+# Локальный VAD для несжатого PCM (WAV linear16): порог амплитуды и запас вокруг речи,
+# чтобы не обрезать первое слово
+_VAD_THRESHOLD = 500
+_VAD_PADDING_S = 0.2
+
+def _find_voiced_span(samples: np.ndarray, threshold: int) -> Optional[tuple]:
+    """Возвращает [начало, конец) участка с сэмплами громче порога или None для тишины."""
+    voiced = np.flatnonzero((samples > threshold) | (samples < -threshold))
+    if voiced.size == 0:
+        return None
+    return int(voiced[0]), int(voiced[-1]) + 1
+
+_DG_CLIENT: Optional[DeepgramClient] = None
+
+def _get_dg_client(api_key: str) -> DeepgramClient:
+    """Возвращает общий для процесса клиент Deepgram (один пул соединений на все сессии)."""
+    global _DG_CLIENT
+    if _DG_CLIENT is None:
+        client_config = DeepgramClientOptions(options={"keepalive": "true"})
+        _DG_CLIENT = DeepgramClient(api_key, client_config)
+    return _DG_CLIENT
+
+
 class TranscriptManager:
     """
     Collects and manages transcript fragments during streaming.
+    Fragments must be added already stripped and non-empty.
     """
     def __init__(self):
         self.fragments = []
+        # Склеенный транскрипт; сбрасывается при добавлении фрагмента
+        self._cached: Optional[str] = None
 
     def add_fragment(self, text: str):
         self.fragments.append(text)
+        self._cached = None
 
     def get_combined_transcript(self) -> str:
-        return ' '.join(self.fragments).strip()
+        if self._cached is None:
+            self._cached = ' '.join(self.fragments)
+        return self._cached
 
     def reset(self):
         self.fragments.clear()
+        self._cached = None
 
 
 class DeepgramSTT:
@@ -42,51 +167,10 @@ class DeepgramSTT:
         if not self.api_key:
             raise ValueError("DEEPGRAM_API_KEY not found in environment variables")
         
-        client_config = DeepgramClientOptions(options={"keepalive": "true"})
-        self.client = DeepgramClient(self.api_key, client_config)
-        
-        # Улучшенные настройки для предзаписанного аудио
-        self.prerecorded_options = PrerecordedOptions(
-            model="nova-2",
-            punctuate=True,
-            language="en-US",
-            smart_format=True,
-            # Улучшения для коротких фраз и предотвращения обрезания первого слова
-            diarize=False,  # Отключаем диаризацию для лучшей производительности
-            utterances=True,  # Включаем разделение на высказывания
-            paragraphs=False,  # Отключаем для коротких фраз
-            detect_language=False,  # Отключаем автоопределение языка
-            # Настройки для улучшения качества и предотвращения обрезания
-            profanity_filter=False,
-            redact=False,
-            search=None,
-            replace=None,
-            keywords=None,
-            version="latest",
-            # Дополнительные настройки для лучшего захвата начала речи
-            multichannel=False,
-            alternatives=1,
-            numerals=True
-        )
-        
-        # Альтернативные настройки для очень коротких фраз (используем nova-2 с другими параметрами)
-        self.short_phrase_options = PrerecordedOptions(
-            model="nova-2",
-            punctuate=True,
-            language="en-US",
-            smart_format=True,
-            utterances=True,
-            detect_language=False,
-            # Более мягкие настройки для коротких фраз чтобы не обрезать первое слово
-            filler_words=False,  # Убираем слова-паразиты
-            profanity_filter=False,
-            redact=False,
-            # Дополнительные настройки для лучшего захвата коротких фраз
-            multichannel=False,
-            alternatives=1,
-            numerals=True,
-            diarize=False
-        )
+        # Общий для процесса клиент и неизменяемые настройки распознавания
+        self.client = _get_dg_client(self.api_key)
+        self.prerecorded_options = _OPTS_STD
+        self.short_phrase_options = _OPTS_SHORT
     
     async def transcribe_audio_bytes(self, audio_bytes: bytes) -> str:
         """
@@ -98,62 +182,144 @@ class DeepgramSTT:
         Returns:
             str: Распознанный текст
         """
+        # Для WAV linear16 обрезаем тишину по краям и получаем точную длительность
+        audio_bytes, duration = self._trim_wav_silence(audio_bytes)
+        if audio_bytes is None:
+            logger.debug("Audio is silent, skipping Deepgram request")
+            return ""
+        
         try:
             # Определяем длительность аудио для выбора оптимальной стратегии
-            audio_duration = self._estimate_audio_duration(audio_bytes)
-            print(f"🎧 Estimated audio duration: {audio_duration:.2f}s")
+            audio_duration = duration if duration is not None else self._estimate_audio_duration(len(audio_bytes))
+            logger.debug("Estimated audio duration: %.2fs", audio_duration)
             
-            # Создаем источник аудио из байтов
+            # Создаем источник аудио из байтов (один буфер на все попытки)
             audio_source = {"buffer": audio_bytes}
             
-            # Пробуем различные конфигурации в порядке приоритета
+            # Конфигурации в порядке приоритета
             configurations = [
                 ("short_phrase", self.short_phrase_options),
                 ("standard", self.prerecorded_options),
                 ("minimal", self._get_minimal_options())
             ]
             
-            transcript = ""
-            for config_name, options in configurations:
-                print(f"🔄 Trying {config_name} configuration...")
-                transcript = await self._try_transcription(audio_source, options)
-                
-                if transcript:
-                    print(f"✅ Success with {config_name} configuration")
-                    break
-                else:
-                    print(f"⚠️ {config_name} configuration failed, trying next...")
+            # Основную конфигурацию выбираем по длительности и пробуем одну
+            primary = self._choose_configuration(audio_duration, configurations)
+            config_name, options = primary
+            logger.debug("Trying %s configuration", config_name)
+            transcript = await self._try_transcription(audio_source, options)
+            
+            if transcript:
+                logger.debug("Success with %s configuration", config_name)
+            else:
+                # Только при пустом результате запускаем остальные конфигурации параллельно:
+                # побеждает первый непустой результат
+                logger.debug("%s configuration failed, trying the rest", config_name)
+                fallbacks = [config for config in configurations if config is not primary]
+                transcript = await self._first_successful(audio_source, fallbacks)
             
             # Постобработка результата
             if transcript:
                 transcript = self._post_process_transcript(transcript)
-                print(f"✅ Final STT result: '{transcript}'")
+                logger.debug("Final STT result: %r", transcript)
             else:
-                print("⚠️ All transcription attempts failed")
+                logger.warning("All transcription attempts failed")
             
             return transcript
             
         except Exception as e:
-            print(f"❌ STT transcription error: {e}")
+            logger.error("STT transcription error: %s", e)
             return ""
     
+    @staticmethod
+    def _choose_configuration(audio_duration: float, configurations: list) -> tuple:
+        """
+        Выбирает основную конфигурацию по длительности аудио:
+        короткие фразы (< 2 с), обычная речь (< 15 с), длинные записи - минимальные настройки.
+        """
+        if audio_duration < 2.0:
+            return configurations[0]
+        if audio_duration < 15.0:
+            return configurations[1]
+        return configurations[2]
+    
+    async def _first_successful(self, audio_source: dict, configurations: list) -> str:
+        """
+        Выполняет транскрипцию со всеми конфигурациями одновременно и возвращает
+        первый непустой результат; остальные запросы отменяются. Если несколько
+        запросов завершились одновременно, берётся конфигурация с большим приоритетом.
+        """
+        tasks = {
+            asyncio.create_task(self._try_transcription(audio_source, options)): config_name
+            for config_name, options in configurations
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Порядок tasks совпадает с приоритетом конфигураций
+                for task, config_name in tasks.items():
+                    if task in done and task.result():
+                        logger.debug("Success with %s configuration", config_name)
+                        return task.result()
+                for task in done:
+                    logger.debug("%s configuration failed", tasks[task])
+            return ""
+        finally:
+            for task in pending:
+                task.cancel()
+    
     def _get_minimal_options(self) -> PrerecordedOptions:
         """
         Минимальные настройки для максимальной совместимости.
         """
-        return PrerecordedOptions(
-            model="nova-2",
-            language="en-US",
-            punctuate=True
-        )
+        return _OPTS_MIN
     
-    def _estimate_audio_duration(self, audio_bytes: bytes) -> float:
+    def _trim_wav_silence(self, audio_bytes: bytes) -> tuple:
+        """
+        Для WAV linear16 обрезает тишину в начале и конце записи (с запасом _VAD_PADDING_S).
+        
+        Returns:
+            (audio_bytes, duration): обрезанный WAV и его длительность; (None, 0.0) если запись
+            целиком тишина; для остальных форматов (например, WebM Opus) - исходные байты и None
+        """
+        if audio_bytes[:4] != b'RIFF' or audio_bytes[8:12] != b'WAVE':
+            return audio_bytes, None
+        try:
+            with wave.open(io.BytesIO(audio_bytes), 'rb') as wav:
+                params = wav.getparams()
+                if params.sampwidth != 2:
+                    return audio_bytes, None
+                frames = wav.readframes(params.nframes)
+        except (wave.Error, EOFError):
+            return audio_bytes, None
+        
+        samples = np.frombuffer(frames, dtype='<i2')
+        span = _find_voiced_span(samples, _VAD_THRESHOLD)
+        if span is None:
+            return None, 0.0
+        
+        # Границы выравниваем по кадрам (все каналы одного момента времени)
+        channels = params.nchannels
+        padding = int(_VAD_PADDING_S * params.framerate) * channels
+        start = max(0, span[0] - padding) // channels * channels
+        end = -(-min(len(samples), span[1] + padding) // channels) * channels
+        
+        trimmed = io.BytesIO()
+        with wave.open(trimmed, 'wb') as out:
+            out.setnchannels(channels)
+            out.setsampwidth(2)
+            out.setframerate(params.framerate)
+            out.writeframes(samples[start:end].tobytes())
+        return trimmed.getvalue(), (end - start) / channels / params.framerate
+    
+    def _estimate_audio_duration(self, size: int) -> float:
         """
         Приблизительная оценка длительности аудио.
         Простая эвристика на основе размера файла.
         """
         # Примерная оценка: WebM Opus ~16kbps для речи
-        estimated_duration = len(audio_bytes) / (16000 / 8)  # байт/сек
+        estimated_duration = size / (16000 / 8)  # байт/сек
         return max(0.1, min(estimated_duration, 30.0))  # Ограничиваем от 0.1 до 30 сек
     
     
@@ -167,20 +333,14 @@ class DeepgramSTT:
                 options
             )
             
-            # Извлекаем текст из ответа
-            if (response.results and
-                response.results.channels and
-                len(response.results.channels) > 0 and
-                response.results.channels[0].alternatives and
-                len(response.results.channels[0].alternatives) > 0):
-                
-                transcript = response.results.channels[0].alternatives[0].transcript
-                return transcript.strip()
-            
-            return ""
+            # Извлекаем текст из ответа: один переход к dict вместо цепочки атрибутов модели
+            data = response.to_dict()
+            channels = (data.get("results") or {}).get("channels") or [{}]
+            alternatives = channels[0].get("alternatives") or []
+            return alternatives[0].get("transcript", "").strip() if alternatives else ""
             
         except Exception as e:
-            print(f"⚠️ Transcription attempt failed: {e}")
+            logger.warning("Transcription attempt failed: %s", e)
             return ""
     
     def _post_process_transcript(self, transcript: str) -> str:
@@ -196,32 +356,9 @@ class DeepgramSTT:
         # Проверяем и исправляем обрезанные первые слова
         transcript = self._fix_truncated_first_word(transcript)
         
-        # Исправляем распространенные ошибки для коротких фраз
-        corrections = {
-            # Распространенные ошибки в коротких ответах
-            'yeah': 'yes',
-            'yep': 'yes',
-            'nope': 'no',
-            'uh huh': 'yes',
-            'mm hmm': 'yes',
-            'uh uh': 'no',
-            # Исправления для технических терминов
-            'react': 'React',
-            'javascript': 'JavaScript',
-            'typescript': 'TypeScript',
-            'node': 'Node',
-            'angular': 'Angular',
-            'vue': 'Vue'
-        }
-        
         # Применяем исправления только для коротких фраз (до 5 слов)
-        words = transcript.split()
-        if len(words) <= 5:
-            transcript_lower = transcript.lower()
-            for wrong, correct in corrections.items():
-                if transcript_lower == wrong or transcript_lower.startswith(wrong + ' ') or transcript_lower.endswith(' ' + wrong):
-                    transcript = transcript_lower.replace(wrong, correct)
-                    break
+        if transcript.count(' ') < 5:
+            transcript = _CORRECTION_RE.sub(lambda m: _CORRECTIONS[m.group(1).lower()], transcript)
         
         return transcript
     
@@ -232,33 +369,12 @@ class DeepgramSTT:
         if not transcript:
             return transcript
         
-        # Словарь для исправления обрезанных слов
-        truncation_fixes = {
-            # Обрезанные приветствия
-        
-            'eact': 'React',
-            'avaScript': 'JavaScript',
-            'ypeScript': 'TypeScript',
-            'ode': 'Node',
-            'ngular': 'Angular',
-            'ue': 'Vue'
-        }
-        
         words = transcript.split()
         if words:
-            first_word = words[0].lower()
-            
-            # Проверяем точные совпадения
-            if first_word in truncation_fixes:
-                words[0] = truncation_fixes[first_word]
+            fix = _TRUNCATION_FIXES_LOWER.get(words[0].lower())
+            if fix:
+                words[0] = fix
                 return ' '.join(words)
-            
-            # Проверяем частичные совпадения для коротких слов (до 4 символов)
-            if len(first_word) <= 4:
-                for truncated, full in truncation_fixes.items():
-                    if first_word == truncated.lower():
-                        words[0] = full
-                        return ' '.join(words)
         
         return transcript
     
@@ -273,12 +389,12 @@ class DeepgramSTT:
             str: Распознанный текст
         """
         try:
-            with open(file_path, 'rb') as audio_file:
-                audio_bytes = audio_file.read()
-                return await self.transcribe_audio_bytes(audio_bytes)
+            # Читаем файл в пуле потоков, не блокируя event loop
+            audio_bytes = await asyncio.to_thread(Path(file_path).read_bytes)
+            return await self.transcribe_audio_bytes(audio_bytes)
                 
         except Exception as e:
-            print(f"STT file transcription error: {e}")
+            logger.error("STT file transcription error: %s", e)
             return ""
 
 async def transcribe_from_microphone():
@@ -309,7 +425,7 @@ async def transcribe_from_microphone():
                 if full_text:  # Only print if there's actual speech
                     print(f"Speaker: {full_text}")
 
-                    if "goodbye" in full_text.lower():
+                    if _STOP_WORDS.intersection(_WORD_RE.findall(full_text.lower())):
                         terminate_event.set()
                 transcript_manager.reset()
 
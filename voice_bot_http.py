@@ -0,0 +1,75 @@
+import importlib.util
+import os
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+# Load environment variables (e.g., OPENROUTER_API_KEY)
+load_dotenv()
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+_openrouter_client: Optional[AsyncOpenAI] = None
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    """
+    HTTP клиент для AsyncOpenAI: транспорт aiohttp (openai[aiohttp]) лучше держит много
+    параллельных сессий интервью; без него - httpx с HTTP/2.
+    """
+    timeout = httpx.Timeout(30.0, connect=2.0)
+    # Пул рассчитан на много одновременных сессий интервью в одном процессе
+    limits = httpx.Limits(max_connections=200, max_keepalive_connections=100)
+    # DefaultAioHttpClient импортируется и без extra, но без httpx_aiohttp падает в конструкторе
+    if importlib.util.find_spec("httpx_aiohttp") is None:
+        return httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+    from openai import DefaultAioHttpClient
+    return DefaultAioHttpClient(limits=limits, timeout=timeout)
+
+
+def get_openrouter_client() -> AsyncOpenAI:
+    """
+    Возвращает общий для всего процесса клиент OpenRouter.
+    Один пул соединений вместо отдельного клиента в каждом модуле.
+    """
+    global _openrouter_client
+    if _openrouter_client is None:
+        _openrouter_client = AsyncOpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=os.getenv("OPENROUTER_API_KEY"),
+            http_client=_build_http_client(),
+        )
+    return _openrouter_client
+
+
+async def close_openrouter_client():
+    """Закрывает общий клиент OpenRouter (вызывается при завершении работы)."""
+    global _openrouter_client
+    if _openrouter_client is not None:
+        await _openrouter_client.close()
+        _openrouter_client = None
+
+
+def with_cache_breakpoints(messages: list, recent_user_turns: int = 2) -> list:
+    """
+    Помечает стабильный префикс запроса точками кэширования (cache_control: ephemeral):
+    системное сообщение и последнее сообщение перед recent_user_turns последними репликами пользователя.
+    Исходные словари истории не изменяются.
+    """
+    def mark(message: dict) -> dict:
+        return {
+            "role": message["role"],
+            "content": [{"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}],
+        }
+    
+    marked = list(messages)
+    marked[0] = mark(marked[0])
+    
+    user_positions = [i for i, m in enumerate(marked) if m["role"] == "user"]
+    if len(user_positions) > recent_user_turns:
+        boundary = user_positions[-recent_user_turns] - 1
+        if boundary > 0:
+            marked[boundary] = mark(marked[boundary])
+    return marked
@@ -1,28 +1,119 @@
 import asyncio
-import json
+import random
+import hashlib
+import logging
+import logging.handlers
+import atexit
+import orjson
 import base64
 import os
 import time
-import io
-from typing import Dict, List
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form
+import secrets
+import sys
+import importlib.util
+import re
+from contextlib import aclosing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from queue import SimpleQueue
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+from cachetools import LRUCache, TTLCache
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
 import uvicorn
 from dotenv import load_dotenv
-import PyPDF2
-from docx import Document
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 # Импорты наших компонентов
 from speech_to_text import DeepgramSTT
 from llm import OpenRouterClient
 from aws_tts import AWSPollyTTS
+from voice_bot_http import close_openrouter_client
 
 load_dotenv()
 
-app = FastAPI(title="Voice Bot API", description="Real-time voice chat bot")
+# Уровень логов задаётся без изменения кода: LOG_LEVEL=DEBUG покажет подробный ход обработки.
+# Обработчики только кладут запись в очередь; форматирование и запись в stdout - в фоновом потоке
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+_log_queue: SimpleQueue = SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# QueueHandler подставляет в запись готовый текст сообщения; префикс добавит StreamHandler
+_log_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    handlers=[_log_queue_handler],
+)
+_log_listener.start()
+# Дописываем оставшиеся в очереди записи при завершении процесса
+atexit.register(_log_listener.stop)
+logger = logging.getLogger("voicebot")
+
+
+def _web_workers() -> int:
+    """
+    Число воркеров сервера. Автоперезагрузка (DEV_RELOAD=1) несовместима с несколькими воркерами.
+    Без REDIS_URL сессии CV хранятся в памяти процесса - по умолчанию один воркер,
+    иначе нужна привязка клиента к воркеру (sticky sessions). С Redis по умолчанию по воркеру на CPU:
+    воркеры асинхронные, больше ядер им не нужно (2 * CPU + 1 - правило для синхронных воркеров gunicorn)
+    """
+    if bool(int(os.getenv("DEV_RELOAD", "0"))):
+        return 1
+    default_workers = (os.cpu_count() or 1) if os.getenv("REDIS_URL") else 1
+    return max(1, int(os.getenv("WEB_WORKERS", os.getenv("WEB_CONCURRENCY", default_workers))))
+
+
+def _init_cv_worker():
+    """
+    Инициализация процесса пула разбора CV: поток QueueListener в дочерний процесс не копируется,
+    поэтому логи воркера пишем в stdout напрямую.
+    """
+    logging.basicConfig(format=LOG_FORMAT, handlers=[logging.StreamHandler()], force=True,
+                        level=logging.getLogger().level)
+
+
+class ServerErrorResponder:
+    """
+    ASGI middleware: единая обработка непредвиденных ошибок HTTP эндпоинтов вместо try/except в каждом.
+    Пишет одну строку в лог (трассировка - только при LOG_LEVEL=DEBUG) и отвечает JSON 500.
+    """
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        response_started = False
+        
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, tracking_send)
+        except Exception as e:
+            if response_started:
+                raise
+            logger.error("❌ %s %s error: %s", scope["method"], scope["path"], e,
+                         exc_info=logger.isEnabledFor(logging.DEBUG))
+            response = ORJSONResponse(status_code=500, content={"error": "Server error processing request"})
+            await response(scope, receive, send)
 
+STATIC_DIR = "static"
+
+app = FastAPI(title="Voice Bot API", description="Real-time voice chat bot", default_response_class=ORJSONResponse)
+
+# Внутри CORS, чтобы ответ об ошибке тоже получал CORS заголовки
+app.add_middleware(ServerErrorResponder)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -30,21 +121,203 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Сжатие HTML страниц и JSON ответов (WebSocket кадры middleware не затрагивает)
+app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
 # Статические файлы
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Наличие каталога проверяется один раз в startup(), а не при импорте модуля
+app.mount("/static", StaticFiles(directory=STATIC_DIR, check_dir=False), name="static")
+
+# Заранее сериализованные неизменные сообщения: отправляются как есть, без сериализации на каждый кадр
+PONG_FRAME = orjson.dumps({"type": "pong"}).decode()
+# Пинг в том виде, в каком его сериализуют JSON.stringify и json.dumps
+PING_FRAMES = frozenset({'{"type":"ping"}', '{"type": "ping"}'})
+PROMPTING_FRAME = orjson.dumps({"type": "status", "message": "🔊 HR is prompting you..."}).decode()
+READY_FOR_RESPONSE_FRAME = orjson.dumps({"type": "completed", "message": "✅ Ready for your response"}).decode()
+GREETING_FRAME = orjson.dumps({"type": "status", "message": "🔊 HR is greeting you..."}).decode()
+READY_TO_HEAR_FRAME = orjson.dumps({"type": "completed", "message": "✅ Ready to hear your response"}).decode()
+RECOGNIZING_FRAME = orjson.dumps({"type": "status", "message": "🎧 Recognizing speech..."}).decode()
+READY_FRAME = orjson.dumps({"type": "completed", "message": "✅ Ready for next question"}).decode()
+
+# Завершающая часть расширенного промпта с CV
+ENHANCED_PROMPT_TRAILER = (
+    "\n\nUse this information to conduct a personalized interview, asking relevant questions based on their CV and experience."
+    "\n\nCRITICAL: Keep response under 30 words. Be extremely brief and direct."
+)
+
+# Граница предложения в потоке ответа LLM: знак конца предложения и пробел после него
+_SENTENCE_END_RE = re.compile(r'[.!?]\s')
+
+# Предел размера PDF: разбор больших файлов (обычно это векторная графика, а не текст) не стоит CPU
+MAX_PDF_SIZE = 20 * 1024 * 1024
+# Предел числа страниц: сильно сжатый PDF на тысячи страниц надолго занимает воркер пула
+MAX_PDF_PAGES = 50
+# Предел длины текста CV (обычное резюме - около 10 тысяч символов)
+MAX_CV_TEXT_CHARS = 200_000
+FILE_TOO_LARGE_ERROR = {"error": "File size must be less than 10MB"}
+# Предел времени чтения и разбора загруженного CV (сек)
+CV_UPLOAD_TIMEOUT = 20
+# Время жизни CV сессии (сек)
+CV_SESSION_TTL = 3600
+
+# Теги WordprocessingML для потокового разбора DOCX
+_DOCX_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_DOCX_TEXT_TAG = _DOCX_NAMESPACE + "t"
+_DOCX_PARAGRAPH_TAG = _DOCX_NAMESPACE + "p"
+
+DEFAULT_SYSTEM_PROMPT = "Ты дружелюбный AI-ассистент. Отвечай кратко и по делу на голосовые сообщения."
+
+class CvTooLongError(ValueError):
+    """CV превышает допустимое число страниц"""
+
+
+def _check_pdf_page_count(page_count: int):
+    """Отклоняет PDF, в котором больше MAX_PDF_PAGES страниц"""
+    if page_count > MAX_PDF_PAGES:
+        raise CvTooLongError(f"CV is too long (max {MAX_PDF_PAGES} pages)")
+
+
+def _count_pdf_pages(pdf_data: bytes) -> int:
+    """Число страниц в PDF."""
+    # pypdfium2 нужен только при загрузке CV - не загружаем его при старте каждого воркера
+    import pypdfium2 as pdfium
+    
+    pdf = pdfium.PdfDocument(pdf_data)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def _extract_pdf_pages(pdf_data: bytes, start: int = 0, stop: int = None) -> List[str]:
+    """
+    Текст страниц PDF с start по stop (не включая). Функция уровня модуля,
+    чтобы её можно было выполнять в пуле процессов. Используется только текстовый слой
+    PDFium (get_textpage): операторы рисования не обрабатываются, страницы не рендерятся.
+    """
+    import pypdfium2 as pdfium
+    
+    pdf = pdfium.PdfDocument(pdf_data)
+    try:
+        _check_pdf_page_count(len(pdf))
+        parts = []
+        for index in range(start, len(pdf) if stop is None else stop):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return parts
+    finally:
+        pdf.close()
+
+
+def _extract_pdf_pages_pypdf2(pdf_data: bytes) -> List[str]:
+    """Текст всех страниц PDF через PyPDF2 - медленнее, но разбирает часть файлов, на которых падает PDFium."""
+    import io
+    import PyPDF2
+    
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_data))
+    _check_pdf_page_count(len(pdf_reader.pages))
+    return [page.extract_text() or "" for page in pdf_reader.pages]
+
+
+def _extract_pdf_text_worker(pdf_data: bytes) -> str:
+    """
+    Извлекает текст из PDF файла (pypdfium2 - нативный PDFium вместо чистого Python, PyPDF2 - запасной вариант).
+    Функция уровня модуля, чтобы её можно было выполнять в пуле процессов.
+    """
+    try:
+        return "\n".join(_extract_pdf_pages(pdf_data)).strip()
+    except CvTooLongError:
+        raise
+    except Exception as e:
+        logger.warning("⚠️ pypdfium2 extraction failed, falling back to PyPDF2: %s", e)
+    
+    try:
+        return "\n".join(_extract_pdf_pages_pypdf2(pdf_data)).strip()
+        
+    except CvTooLongError:
+        raise
+    except Exception as e:
+        logger.error("❌ PDF extraction error: %s", e)
+        return None
+
+
+def _extract_docx_text_worker(docx_data: bytes) -> str:
+    """
+    Извлекает текст из DOCX файла потоковым разбором word/document.xml (lxml.iterparse):
+    без построения полного дерева документа, обработанные элементы сразу освобождаются.
+    Текст таблиц тоже лежит в узлах w:t, поэтому отдельный обход таблиц не нужен.
+    Функция уровня модуля, чтобы её можно было выполнять в пуле процессов.
+    """
+    try:
+        # Библиотеки разбора CV импортируем при первой загрузке, а не при старте воркера
+        import io
+        import zipfile
+        from lxml import etree
+        
+        lines = []
+        runs = []
+        with zipfile.ZipFile(io.BytesIO(docx_data)) as archive:
+            with archive.open("word/document.xml") as document:
+                for _, elem in etree.iterparse(document, events=("end",), tag=(_DOCX_TEXT_TAG, _DOCX_PARAGRAPH_TAG)):
+                    if elem.tag == _DOCX_TEXT_TAG:
+                        runs.append(elem.text or "")
+                    else:
+                        # Конец абзаца (в том числе абзаца внутри ячейки таблицы)
+                        line = "".join(runs)
+                        if line.strip():
+                            lines.append(line)
+                        runs.clear()
+                    elem.clear()
+        
+        return "\n".join(lines).strip()
+        
+    except Exception as e:
+        logger.error("❌ DOCX extraction error: %s", e)
+        return None
+
+
+# Маркер в очереди отправки: дослать всё, что перед ним, и закрыть соединение
+_CLOSE_FRAME = object()
+
+
+@dataclass(slots=True)
+class UserState:
+    """Всё состояние подключённого пользователя в одной записи: один поиск по user_id вместо шести словарей"""
+    ws: WebSocket
+    session: dict  # История разговора, текст CV и данные кандидата
+    send_queue: asyncio.Queue  # Очередь исходящих кадров
+    sender_task: Optional[asyncio.Task] = None  # Единственный писатель в WebSocket
+    llm: Optional[OpenRouterClient] = None  # Отдельный LLM клиент пользователя
+    enhanced_prompt: Optional[str] = None  # Системный промпт с данными CV (None - базовый)
+    timeout_task: Optional[asyncio.Task] = None  # Постоянная задача таймаута
+    timeout_event: asyncio.Event = field(default_factory=asyncio.Event)  # Сигнал задаче таймаута об изменении состояния
+    timeout_active: bool = False  # Таймаут запущен
+    timeout_paused: bool = False  # Таймаут приостановлен (voice_start)
+    timeout_stage: int = 0  # Стадия таймаута (0 - нет, 1..3)
+    timeout_awaiting_playback: bool = False  # Ждём окончания воспроизведения напоминания
+
 
 class VoiceBotWebSocket:
     """WebSocket менеджер для голосового бота"""
     
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.user_sessions: Dict[str, dict] = {}
-        self.cv_sessions: Dict[str, dict] = {}  # Хранилище для CV сессий
-        self.user_llm_clients: Dict[str, OpenRouterClient] = {}  # Отдельный LLM клиент для каждого пользователя
-        self.user_timeout_tasks: Dict[str, asyncio.Task] = {}  # Задачи таймаута для каждого пользователя
-        self.user_timeout_active: Dict[str, bool] = {}  # Флаг активного таймаута для каждого пользователя
-        self.user_timeout_paused: Dict[str, bool] = {}  # Флаг приостановленного таймаута (voice_start)
-        self.user_timeout_stage: Dict[str, int] = {}  # Стадия таймаута (0, 1, 2)
+        self.users: Dict[str, UserState] = {}  # Подключённые пользователи (удаляются в disconnect())
+        self.cv_sessions: Dict[str, dict] = TTLCache(maxsize=10000, ttl=CV_SESSION_TTL)  # CV сессии живут 1 час
+        # При заданном REDIS_URL CV сессии хранятся в Redis и доступны всем воркерам;
+        # без него - в памяти процесса (один воркер или sticky sessions)
+        self.redis = None
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            import redis.asyncio as aioredis
+            self.redis = aioredis.Redis.from_url(redis_url)
+            logger.info("🗄️ CV sessions are stored in Redis")
+        # Очередь сроков истечения CV сессий в порядке добавления (TTL у всех одинаковый)
+        self._cv_expiry: deque = deque()
+        self._cv_expiry_event = asyncio.Event()
+        # Задачи досылки очередей отключаемых пользователей (держим ссылки до завершения)
+        self._closing_tasks: set = set()
         self.timeout_responses = {
             1: [  # Первая напоминалка (5 сек)
                 "I didn't catch your response — would you like me to repeat the question?",
@@ -62,273 +335,328 @@ class VoiceBotWebSocket:
                 "Thank you for your interest. We'll reach out to you regarding next steps."
             ]
         }
+        # Заранее синтезированные чанки напоминаний: текст -> MP3 чанки (заполняется при старте)
+        self.timeout_audio_cache: Dict[str, List[bytes]] = {}
+        
+        # Отдельный пул для CPU-тяжёлой работы с CV (base64, разбор PDF/DOCX),
+        # чтобы не блокировать цикл событий и не занимать пул по умолчанию
+        self.cv_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cv")
+        # Пул процессов для разбора CV: страницы многостраничных PDF параллельно, DOCX и PyPDF2
+        # (чистый Python) - вне процесса сервера, чтобы не держать GIL цикла событий. Процессы стартуют по требованию.
+        # Ядра делятся между воркерами сервера: у каждого свой пул, всего процессов не больше числа CPU
+        self.cv_workers = max(1, (os.cpu_count() or 1) // _web_workers())
+        self.cv_process_pool = ProcessPoolExecutor(max_workers=self.cv_workers, initializer=_init_cv_worker)
+        # Текст уже разобранных CV (PDF и DOCX) по SHA-256 их содержимого (повторная загрузка того же CV)
+        self._cv_text_cache: Dict[bytes, str] = LRUCache(maxsize=256)
         
         # Инициализируем компоненты
         try:
-            print("🔧 Initializing STT...")
+            logger.info("🔧 Initializing STT...")
             self.stt = DeepgramSTT()
-            print("✅ STT initialized")
+            logger.info("✅ STT initialized")
             
-            print("🔧 Initializing TTS...")
+            logger.info("🔧 Initializing TTS...")
             self.tts = AWSPollyTTS(voice_id="Ruth", engine="generative", chunk_size=200)
-            print("✅ TTS initialized")
+            logger.info("✅ TTS initialized")
             
             # Системный промпт
-            print("🔧 Loading system prompt...")
+            logger.info("🔧 Loading system prompt...")
             self.system_prompt = self._load_system_prompt()
-            print("✅ System prompt loaded")
+            logger.info("✅ System prompt loaded")
             
         except Exception as e:
-            print(f"❌ Initialization error: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error("❌ Initialization error: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             raise
     
     def _load_system_prompt(self) -> str:
         """Загружает системный промпт"""
         try:
             with open("Bot_prompt.txt", 'r', encoding='utf-8') as f:
-                return f.read().strip()
+                return sys.intern(f.read().strip())
         except FileNotFoundError:
-            return "Ты дружелюбный AI-ассистент. Отвечай кратко и по делу на голосовые сообщения."
+            return DEFAULT_SYSTEM_PROMPT
     
-    def _extract_pdf_text(self, pdf_data: bytes) -> str:
-        """Извлекает текст из PDF файла"""
-        try:
-            # Создаем объект BytesIO для работы с PDF
-            pdf_stream = io.BytesIO(pdf_data)
-            
-            # Читаем PDF
-            pdf_reader = PyPDF2.PdfReader(pdf_stream)
-            
-            # Извлекаем текст со всех страниц
-            text_content = ""
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text_content += page.extract_text() + "\n"
-            
-            return text_content.strip()
-            
-        except Exception as e:
-            print(f"❌ PDF extraction error: {e}")
+    async def extract_pdf_text(self, pdf_data: bytes) -> str:
+        """
+        Извлекает текст из PDF, не блокируя цикл событий. Многостраничные PDF
+        разбираются параллельно в пуле процессов диапазонами страниц; одностраничные -
+        в пуле потоков, чтобы не платить за передачу данных между процессами.
+        Результат кэшируется по SHA-256 содержимого файла.
+        Бросает CvTooLongError, если в PDF больше MAX_PDF_PAGES страниц.
+        """
+        if len(pdf_data) > MAX_PDF_SIZE:
+            logger.warning("⚠️ PDF rejected: %s bytes exceeds %s", len(pdf_data), MAX_PDF_SIZE)
             return None
+        
+        return await self._cached_cv_text(pdf_data, self._extract_pdf_text_parallel)
+    
+    async def _cached_cv_text(self, data: bytes, extract) -> str:
+        """Возвращает текст CV из кэша по SHA-256 файла или извлекает его через extract и кэширует"""
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(self.cv_executor, lambda: hashlib.sha256(data).digest())
+        cached = self._cv_text_cache.get(digest)
+        if cached is not None:
+            logger.debug("📄 CV text cache hit")
+            return cached
+        
+        text = await extract(data)
+        if text:
+            # Промпт не должен разрастаться из-за аномально длинного CV
+            text = text[:MAX_CV_TEXT_CHARS]
+            self._cv_text_cache[digest] = text
+        return text
     
-    def _extract_docx_text(self, docx_data: bytes) -> str:
-        """Извлекает текст из DOCX файла"""
+    async def _extract_pdf_text_parallel(self, pdf_data: bytes) -> str:
+        """Разбор PDF в пуле процессов (многостраничные) или потоков (одностраничные)"""
+        loop = asyncio.get_running_loop()
         try:
-            # Создаем объект BytesIO для работы с DOCX
-            docx_stream = io.BytesIO(docx_data)
-            
-            # Читаем DOCX
-            doc = Document(docx_stream)
-            
-            # Извлекаем текст из всех параграфов
-            text_content = ""
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text_content += paragraph.text + "\n"
-            
-            # Также извлекаем текст из таблиц
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            text_content += cell.text + " "
-                    text_content += "\n"
-            
-            return text_content.strip()
-            
+            page_count = await loop.run_in_executor(self.cv_executor, _count_pdf_pages, pdf_data)
+            _check_pdf_page_count(page_count)
+            if page_count <= 1:
+                return await loop.run_in_executor(self.cv_executor, _extract_pdf_text_worker, pdf_data)
+            
+            # Один диапазон страниц на процесс: документ открывается по разу в каждом процессе
+            workers = min(page_count, self.cv_workers)
+            step = -(-page_count // workers)
+            ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(self.cv_process_pool, _extract_pdf_pages, pdf_data, start, stop)
+                for start, stop in ranges
+            ))
+            return "\n".join(text for part in parts for text in part).strip()
+            
+        except CvTooLongError:
+            raise
         except Exception as e:
-            print(f"❌ DOCX extraction error: {e}")
-            return None
+            # Последовательный разбор с запасным PyPDF2
+            logger.warning("⚠️ Parallel PDF extraction failed: %s", e)
+            return await loop.run_in_executor(self.cv_process_pool, _extract_pdf_text_worker, pdf_data)
     
-    def cleanup_old_cv_sessions(self):
-        """Очищает старые CV сессии (старше 1 часа)"""
-        current_time = time.time()
-        old_sessions = []
-        
-        for session_id, session_data in self.cv_sessions.items():
-            if current_time - session_data.get("uploaded_at", 0) > 3600:  # 1 час
-                old_sessions.append(session_id)
-        
-        for session_id in old_sessions:
-            del self.cv_sessions[session_id]
-            print(f"🧹 Cleaned up old CV session: {session_id}")
-        
-        # Также очищаем неактивные LLM клиенты
-        inactive_users = []
-        for user_id in self.user_llm_clients.keys():
-            if user_id not in self.active_connections:
-                inactive_users.append(user_id)
-        
-        for user_id in inactive_users:
-            self.user_llm_clients[user_id].clear_history()
-            del self.user_llm_clients[user_id]
-            print(f"🧹 Cleaned up inactive LLM client for user: {user_id}")
-        
-        return len(old_sessions)
+    async def extract_docx_text(self, docx_data: bytes) -> str:
+        """Извлекает текст из DOCX в пуле процессов, не блокируя цикл событий (с кэшем по SHA-256)"""
+        return await self._cached_cv_text(docx_data, self._extract_docx_text_in_pool)
+    
+    async def _extract_docx_text_in_pool(self, docx_data: bytes) -> str:
+        """Разбор DOCX в пуле процессов"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.cv_process_pool, _extract_docx_text_worker, docx_data)
     
     def get_user_llm_client(self, user_id: str) -> OpenRouterClient:
         """Получает или создает LLM клиент для конкретного пользователя"""
-        if user_id not in self.user_llm_clients:
-            print(f"🔧 Creating new LLM client for user {user_id}")
-            self.user_llm_clients[user_id] = OpenRouterClient()
-        return self.user_llm_clients[user_id]
+        state = self.users.get(user_id)
+        if state is None:
+            # Пользователь уже отключился - временный клиент, который никуда не сохраняется
+            return OpenRouterClient(user_id=user_id)
+        if state.llm is None:
+            logger.debug("🔧 Creating new LLM client for user %s", user_id)
+            state.llm = OpenRouterClient(user_id=user_id)
+        return state.llm
+    
+    # Время ожидания ответа на каждой стадии таймаута (сек)
+    TIMEOUT_STAGE_WAITS = {1: 15.0, 2: 25.0, 3: 30.0}
     
     async def start_response_timeout(self, user_id: str):
         """Запускает таймер ожидания ответа пользователя"""
+        state = self.users.get(user_id)
+        if state is None:
+            return
         # Проверяем, не активен ли уже таймер
-        if self.user_timeout_active.get(user_id, False):
-            print(f"⏰ Timeout already active for {user_id}, skipping")
+        if state.timeout_active:
+            logger.debug("⏰ Timeout already active for %s, skipping", user_id)
             return
-            
-        # Отменяем предыдущий таймер если есть
-        if user_id in self.user_timeout_tasks:
-            self.user_timeout_tasks[user_id].cancel()
         
         # Устанавливаем флаг активного таймера и начальную стадию
-        self.user_timeout_active[user_id] = True
-        self.user_timeout_stage[user_id] = 1  # Начинаем с первой стадии
-        
-        # Создаем новый таймер (первая стадия - 5 секунд)
-        self.user_timeout_tasks[user_id] = asyncio.create_task(
-            self._timeout_handler(user_id)
-        )
+        state.timeout_active = True
+        state.timeout_stage = 1  # Начинаем с первой стадии
+        state.timeout_awaiting_playback = False
+        state.timeout_event.set()
     
     async def pause_response_timeout(self, user_id: str):
         """Приостанавливает таймер ожидания ответа (voice_start)"""
-        self.user_timeout_paused[user_id] = True
-        print(f"⏸️ Timeout paused for {user_id}")
+        state = self.users.get(user_id)
+        if state is not None:
+            state.timeout_paused = True
+            logger.debug("⏸️ Timeout paused for %s", user_id)
     
     async def resume_response_timeout(self, user_id: str):
         """Возобновляет таймер ожидания ответа если он был приостановлен"""
-        if self.user_timeout_paused.get(user_id, False):
-            self.user_timeout_paused[user_id] = False
-            print(f"▶️ Timeout resumed for {user_id}")
+        state = self.users.get(user_id)
+        if state is not None and state.timeout_paused:
+            state.timeout_paused = False
+            logger.debug("▶️ Timeout resumed for %s", user_id)
+            state.timeout_event.set()
     
     async def cancel_response_timeout(self, user_id: str):
         """Отменяет таймер ожидания ответа"""
+        state = self.users.get(user_id)
+        if state is None:
+            return
         # Сбрасываем флаг активного таймера и стадию
-        self.user_timeout_active[user_id] = False
-        self.user_timeout_paused[user_id] = False
-        self.user_timeout_stage[user_id] = 0
-        
-        if user_id in self.user_timeout_tasks:
-            self.user_timeout_tasks[user_id].cancel()
-            del self.user_timeout_tasks[user_id]
+        state.timeout_active = False
+        state.timeout_paused = False
+        state.timeout_stage = 0
+        state.timeout_awaiting_playback = False
+        state.timeout_event.set()
     
-    async def _timeout_handler(self, user_id: str):
-        """Обработчик таймаута с тремя стадиями"""
+    def timeout_playback_complete(self, user_id: str):
+        """Напоминание о таймауте доиграло у клиента - переходим к следующей стадии"""
+        state = self.users.get(user_id)
+        if state is not None and state.timeout_awaiting_playback:
+            state.timeout_awaiting_playback = False
+            state.timeout_event.set()
+    
+    async def _wait_timeout_signal(self, event: asyncio.Event, condition, timeout: float = None) -> bool:
+        """
+        Ждёт, пока condition() станет истинным (проверяется после каждого сигнала).
+        Возвращает False, если время вышло раньше.
+        Один asyncio.timeout на всё ожидание: без отдельной задачи wait_for на каждый сигнал.
+        """
+        deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
         try:
-            stage = self.user_timeout_stage.get(user_id, 1)
-            
-            # Определяем время ожидания в зависимости от стадии
-            if stage == 1:
-                wait_time = 15.0  # Первая напоминалка через 5 сек
-            elif stage == 2:
-                wait_time = 25.0  # Вторая напоминалка через 10 сек
-            else:  # stage == 3
-                wait_time = 30.0  # Завершение через 10 сек
-            
-            print(f"⏰ Starting timeout stage {stage} for {user_id} (waiting {wait_time}s)")
-            await asyncio.sleep(wait_time)
-            
-            # Проверяем, что таймер все еще активен и не приостановлен
-            if not self.user_timeout_active.get(user_id, False):
-                return
-            
-            # Если таймер приостановлен (voice_start), ждем еще немного
-            if self.user_timeout_paused.get(user_id, False):
-                print(f"⏸️ Timeout paused for {user_id}, waiting...")
-                await asyncio.sleep(1.0)  # Ждем 1 секунду и проверяем снова
-                if self.user_timeout_paused.get(user_id, False):
-                    # Если все еще приостановлен, перезапускаем обработчик
-                    self.user_timeout_tasks[user_id] = asyncio.create_task(
-                        self._timeout_handler(user_id)
+            async with asyncio.timeout_at(deadline):
+                while True:
+                    event.clear()
+                    if condition():
+                        return True
+                    await event.wait()
+        except TimeoutError:
+            return condition()
+    
+    async def _timeout_supervisor(self, user_id: str, state: UserState):
+        """
+        Единственная задача таймаута на пользователя: проходит три стадии напоминаний.
+        Управляется флагами состояния и asyncio.Event, без пересоздания задач на каждой стадии.
+        """
+        event = state.timeout_event
+        active = lambda: state.timeout_active
+        try:
+            while True:
+                # Ждём запуска таймера (после воспроизведения ответа бота)
+                await self._wait_timeout_signal(event, active)
+                stage = state.timeout_stage or 1
+                wait_time = self.TIMEOUT_STAGE_WAITS[stage]
+                
+                logger.debug("⏰ Starting timeout stage %s for %s (waiting %ss)", stage, user_id, wait_time)
+                # Ответ пользователя (cancel_response_timeout) сбрасывает флаг и будит задачу
+                if await self._wait_timeout_signal(event, lambda: not active(), wait_time):
+                    continue
+                
+                # Если таймер приостановлен (voice_start), ждём возобновления и начинаем стадию заново
+                if state.timeout_paused:
+                    logger.debug("⏸️ Timeout paused for %s, waiting...", user_id)
+                    await self._wait_timeout_signal(
+                        event,
+                        lambda: not active() or not state.timeout_paused
                     )
+                    continue
+                
+                # Если дошли сюда, значит пользователь не ответил
+                timeout_message = random.choice(self.timeout_responses[stage])
+                
+                logger.debug("⏰ Timeout stage %s for user %s: %s", stage, user_id, timeout_message)
+                
+                # Озвучиваем сообщение о таймауте (текст отправляется одновременно с первым аудио чанком)
+                if stage == 3:
+                    await self.send_message(user_id, {
+                        "type": "status",
+                        "message": "🔊 HR is ending the interview..."
+                    })
+                else:
+                    await self.send_message(user_id, PROMPTING_FRAME)
+                
+                await self._synthesize_and_send_audio(user_id, timeout_message, "bot_waiting")
+                
+                if stage == 3:
+                    # Завершаем интервью
+                    await self.send_message(user_id, {
+                        "type": "interview_ended",
+                        "message": "🔚 Interview ended due to no response"
+                    })
+                    
+                    # Отключаем пользователя
+                    logger.debug("🔚 Ending interview for %s due to no response", user_id)
+                    self.disconnect(user_id, graceful=True)
                     return
-            
-            # Если дошли сюда, значит пользователь не ответил
-            import random
-            timeout_message = random.choice(self.timeout_responses[stage])
-            
-            print(f"⏰ Timeout stage {stage} for user {user_id}: {timeout_message}")
-            
-            # Озвучиваем сообщение о таймауте (текст отправляется одновременно с первым аудио чанком)
-            if stage == 3:
-                await self.send_message(user_id, {
-                    "type": "status",
-                    "message": "🔊 HR is ending the interview..."
-                })
-            else:
-                await self.send_message(user_id, {
-                    "type": "status",
-                    "message": "🔊 HR is prompting you..."
-                })
-            
-            await self._synthesize_and_send_audio(user_id, timeout_message, "bot_waiting")
-            
-            if stage == 3:
-                # Завершаем интервью
-                await self.send_message(user_id, {
-                    "type": "interview_ended",
-                    "message": "🔚 Interview ended due to no response"
-                })
                 
-                # Отключаем пользователя
-                print(f"🔚 Ending interview for {user_id} due to no response")
-                self.disconnect(user_id)
-                return
-            else:
-                await self.send_message(user_id, {
-                    "type": "completed",
-                    "message": "✅ Ready for your response"
-                })
-            
-            # Переходим к следующей стадии
-            self.user_timeout_stage[user_id] = stage + 1
-            
-            # ВАЖНО: НЕ сбрасываем флаг здесь - оставляем активным до audio_playback_complete
-            # Это предотвратит запуск новых таймеров пока играет timeout сообщение
-            
+                await self.send_message(user_id, READY_FOR_RESPONSE_FRAME)
+                
+                # Переходим к следующей стадии, как только напоминание доиграет у клиента
+                # (флаг активности не сбрасываем, чтобы пока играет сообщение не запустился новый таймер)
+                state.timeout_stage = stage + 1
+                state.timeout_awaiting_playback = True
+                await self._wait_timeout_signal(
+                    event,
+                    lambda: not active() or not state.timeout_awaiting_playback
+                )
+                
         except asyncio.CancelledError:
-            # Таймер был отменен (пользователь ответил вовремя)
-            self.user_timeout_active[user_id] = False
-            self.user_timeout_stage[user_id] = 0
+            # Пользователь отключился
+            pass
         except Exception as e:
-            print(f"❌ Timeout handler error for {user_id}: {e}")
-            self.user_timeout_active[user_id] = False
-            self.user_timeout_stage[user_id] = 0
+            logger.error("❌ Timeout handler error for %s: %s", user_id, e)
+            state.timeout_active = False
+            state.timeout_stage = 0
+    
+    def _build_enhanced_prompt(self, candidate_info: dict = None, cv_text: str = None) -> str:
+        """
+        Системный промпт с данными кандидата и CV. Строится один раз на сессию,
+        чтобы префикс запроса был байт-в-байт одинаковым и кэшировался провайдером.
+        """
+        if not cv_text and not candidate_info:
+            return self.system_prompt
+        
+        # Собираем фрагменты и склеиваем одним join - одна аллокация под итоговую строку
+        parts = [self.system_prompt, "\n\nCANDIDATE INFORMATION:"]
+        
+        if candidate_info:
+            parts.append(
+                f"\nName: {candidate_info.get('firstName', '')} {candidate_info.get('lastName', '')}"
+                f"\nEmail: {candidate_info.get('email', '')}"
+            )
+        
+        if cv_text:
+            parts.extend(["\n\nCV CONTENT:\n", cv_text])
+        
+        parts.append(ENHANCED_PROMPT_TRAILER)
+        return "".join(parts)
     
     async def connect(self, websocket: WebSocket, user_id: str, session_id: str = None):
         """Подключение нового пользователя"""
         await websocket.accept()
-        self.active_connections[user_id] = websocket
-        self.user_sessions[user_id] = {
-            "conversation_history": [],
-            "connected_at": time.time(),
-            "cv_text": None,
-            "candidate_info": None
-        }
-        
-        # Очищаем старые сессии
-        self.cleanup_old_cv_sessions()
+        # Все отправки идут через очередь и одну задачу-отправителя: кадры не перемешиваются,
+        # а медленный клиент ограничен размером очереди
+        state = UserState(
+            ws=websocket,
+            session={
+                # Скользящее окно последних 6 ходов (6 реплик пользователя + 6 ответов)
+                "conversation_history": deque(maxlen=12),
+                "connected_at": time.time(),
+                "cv_text": None,
+                "candidate_info": None
+            },
+            send_queue=asyncio.Queue(maxsize=256)
+        )
+        self.users[user_id] = state
+        state.sender_task = asyncio.create_task(self._sender(user_id, websocket, state.send_queue))
+        # Одна задача таймаута на всё соединение; стадии переключаются по сигналам
+        state.timeout_task = asyncio.create_task(self._timeout_supervisor(user_id, state))
         
         # Загружаем данные CV если есть session_id
-        if session_id and session_id in self.cv_sessions:
-            session_data = self.cv_sessions[session_id]
-            self.user_sessions[user_id]["cv_text"] = session_data["cv_text"]
-            self.user_sessions[user_id]["candidate_info"] = session_data["candidate_info"]
+        session_data = await self.load_cv_session(session_id) if session_id else None
+        if session_data is not None:
+            state.session["cv_text"] = session_data["cv_text"]
+            state.session["candidate_info"] = session_data["candidate_info"]
+            state.enhanced_prompt = session_data["enhanced_prompt"]
             
             candidate = session_data["candidate_info"]
-            print(f"📄 Loaded CV data for {candidate['firstName']} {candidate['lastName']}")
+            logger.debug("📄 Loaded CV data for %s %s", candidate['firstName'], candidate['lastName'])
         
         await self.send_message(user_id, {
             "type": "connected",
             "message": "🎤 HR Interview starting!"
         })
         
-        print(f"✅ User {user_id} connected")
+        logger.info("✅ User %s connected", user_id)
         
         # Автоматически начинаем интервью
         await self.start_interview(user_id)
@@ -336,122 +664,173 @@ class VoiceBotWebSocket:
     async def start_interview(self, user_id: str):
         """Автоматически начинает интервью с приветствием HR"""
         try:
-            print(f"🎬 Starting automatic interview for {user_id}")
+            logger.debug("🎬 Starting automatic interview for %s", user_id)
             
             # Генерируем приветственное сообщение от HR
             greeting_prompt = "Start the interview exactly as instructed in the prompt. Follow the 'Begin with:' instruction precisely."
             
-            # Создаем расширенный системный промпт с CV и данными кандидата если есть
-            enhanced_prompt = self.system_prompt
-            if user_id in self.user_sessions:
-                session = self.user_sessions[user_id]
-                if session.get("cv_text") or session.get("candidate_info"):
-                    enhanced_prompt = f"""{self.system_prompt}
-
-CANDIDATE INFORMATION:"""
-                    
-                    if session.get("candidate_info"):
-                        candidate = session["candidate_info"]
-                        enhanced_prompt += f"""
-Name: {candidate.get('firstName', '')} {candidate.get('lastName', '')}
-Email: {candidate.get('email', '')}"""
-                    
-                    if session.get("cv_text"):
-                        enhanced_prompt += f"""
-
-CV CONTENT:
-{session['cv_text']}"""
-                    
-                    enhanced_prompt += """
-
-Use this information to conduct a personalized interview, asking relevant questions based on their CV and experience.
-
-CRITICAL: Keep response under 30 words. Be extremely brief and direct."""
+            # Расширенный системный промпт собран один раз при загрузке CV
+            enhanced_prompt = self._enhanced_prompt_for(user_id)
             
-            # Получаем персональный LLM клиент для пользователя
+            # Получаем персональный LLM клиент для пользователя; приветствие не берём из общего кэша,
+            # иначе все кандидаты без CV получали бы один и тот же ответ
             user_llm = self.get_user_llm_client(user_id)
-            bot_response, interview_ended = await user_llm.chat_completion(greeting_prompt, enhanced_prompt)
-            print(f"🤖 HR greeting to {user_id}: {bot_response}")
+            bot_response, interview_ended = await user_llm.chat_completion(greeting_prompt, enhanced_prompt, use_cache=False)
+            logger.debug("🤖 HR greeting to %s: %s", user_id, bot_response)
             
             # Проверяем, не завершилось ли интервью сразу (маловероятно, но на всякий случай)
             if interview_ended:
-                print(f"🎯 Interview ended immediately for {user_id}")
+                logger.debug("🎯 Interview ended immediately for %s", user_id)
                 await self._handle_interview_completion(user_id, bot_response)
                 return
             
             # Озвучиваем приветствие (текст отправляется одновременно с первым аудио чанком)
-            await self.send_message(user_id, {
-                "type": "status",
-                "message": "🔊 HR is greeting you..."
-            })
+            await self.send_message(user_id, GREETING_FRAME)
             
             await self._synthesize_and_send_audio(user_id, bot_response)
             
-            await self.send_message(user_id, {
-                "type": "completed",
-                "message": "✅ Ready to hear your response"
-            })
+            await self.send_message(user_id, READY_TO_HEAR_FRAME)
             
             # НЕ запускаем таймер здесь - ждем уведомления о завершении воспроизведения
             # await self.start_response_timeout(user_id)
             
         except Exception as e:
-            print(f"❌ Error starting interview for {user_id}: {e}")
+            logger.error("❌ Error starting interview for %s: %s", user_id, e)
             await self.send_message(user_id, {
                 "type": "error",
                 "message": "❌ Error starting interview"
             })
     
-    def disconnect(self, user_id: str):
-        """Отключение пользователя"""
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        if user_id in self.user_sessions:
-            del self.user_sessions[user_id]
-        if user_id in self.user_llm_clients:
+    async def store_cv_session(self, session_id: str, data: dict):
+        """Сохраняет CV сессию и ставит её срок истечения в очередь фоновой очистки"""
+        if self.redis is not None:
+            # Redis сам удаляет ключ по истечении TTL
+            await self.redis.setex(f"cv:{session_id}", CV_SESSION_TTL, orjson.dumps(data))
+            return
+        self.cv_sessions[session_id] = data
+        self._cv_expiry.append(time.monotonic() + CV_SESSION_TTL)
+        self._cv_expiry_event.set()
+    
+    async def reap_cv_sessions(self):
+        """
+        Фоновая очистка CV сессий: спит до ближайшего срока истечения и удаляет просроченные.
+        TTLCache сам чистится только при обращениях, поэтому без этой задачи тексты CV
+        висели бы в памяти простаивающего сервера до следующей загрузки.
+        """
+        if self.redis is not None:
+            return
+        while True:
+            if not self._cv_expiry:
+                self._cv_expiry_event.clear()
+                await self._cv_expiry_event.wait()
+                continue
+            delay = self._cv_expiry[0] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self._cv_expiry.popleft()
+            # expire() снимает просроченные записи с головы списка TTLCache - O(1) на запись
+            self.cv_sessions.expire()
+    
+    async def load_cv_session(self, session_id: str) -> Optional[dict]:
+        """Возвращает данные CV сессии или None, если сессии нет или она истекла"""
+        if self.redis is not None:
+            raw = await self.redis.get(f"cv:{session_id}")
+            return orjson.loads(raw) if raw is not None else None
+        return self.cv_sessions.get(session_id)
+    
+    def _enhanced_prompt_for(self, user_id: str) -> str:
+        """Расширенный системный промпт пользователя или базовый, если CV не загружено"""
+        state = self.users.get(user_id)
+        if state is None or state.enhanced_prompt is None:
+            return self.system_prompt
+        return state.enhanced_prompt
+    
+    def disconnect(self, user_id: str, graceful: bool = False):
+        """
+        Отключение пользователя. При graceful уже поставленные в очередь кадры (прощальное
+        аудио, interview_ended) досылаются, после чего соединение закрывается;
+        иначе (клиент ушёл, ошибка отправки) отправитель отменяется сразу.
+        """
+        state = self.users.pop(user_id, None)
+        if state is None:
+            return
+        if state.sender_task is not None:
+            if graceful:
+                task = asyncio.create_task(self._close_after_drain(user_id, state))
+                self._closing_tasks.add(task)
+                task.add_done_callback(self._closing_tasks.discard)
+            else:
+                state.sender_task.cancel()
+        if state.llm is not None:
             # Очищаем историю разговора перед удалением
-            self.user_llm_clients[user_id].clear_history()
-            del self.user_llm_clients[user_id]
-            print(f"🧹 Cleared LLM client for user {user_id}")
-        # Отменяем таймер ожидания если есть
-        if user_id in self.user_timeout_tasks:
-            self.user_timeout_tasks[user_id].cancel()
-            del self.user_timeout_tasks[user_id]
-            print(f"🧹 Cancelled timeout task for user {user_id}")
-        # Очищаем флаги таймаута
-        if user_id in self.user_timeout_active:
-            del self.user_timeout_active[user_id]
-        if user_id in self.user_timeout_paused:
-            del self.user_timeout_paused[user_id]
-        if user_id in self.user_timeout_stage:
-            del self.user_timeout_stage[user_id]
-        print(f"❌ User {user_id} disconnected")
-    
-    async def send_message(self, user_id: str, message: dict):
-        """Отправка сообщения пользователю"""
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_text(json.dumps(message, ensure_ascii=False))
-            except Exception as e:
-                print(f"❌ Send error to {user_id}: {e}")
-                self.disconnect(user_id)
+            state.llm.clear_history()
+            logger.debug("🧹 Cleared LLM client for user %s", user_id)
+        # Отменяем таймер ожидания
+        if state.timeout_task is not None:
+            state.timeout_task.cancel()
+            logger.debug("🧹 Cancelled timeout task for user %s", user_id)
+        logger.info("❌ User %s disconnected", user_id)
+    
+    # Сколько ждать досылки очереди при graceful отключении, прежде чем отменить отправителя (сек)
+    CLOSE_DRAIN_TIMEOUT = 10.0
+    
+    async def _close_after_drain(self, user_id: str, state: UserState):
+        """Ставит в очередь маркер закрытия и ждёт, пока отправитель дошлёт всё до него"""
+        try:
+            async with asyncio.timeout(self.CLOSE_DRAIN_TIMEOUT):
+                await state.send_queue.put(_CLOSE_FRAME)
+                await state.sender_task
+        except TimeoutError:
+            logger.warning("⚠️ Send queue of %s not drained in %.0fs, dropping", user_id, self.CLOSE_DRAIN_TIMEOUT)
+            state.sender_task.cancel()
+    
+    async def _sender(self, user_id: str, websocket: WebSocket, queue: asyncio.Queue):
+        """Отправляет кадры из очереди пользователя по порядку: str - текстовый кадр, bytes - бинарный (аудио)"""
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is _CLOSE_FRAME:
+                    await websocket.close()
+                    return
+                if isinstance(frame, bytes):
+                    await websocket.send_bytes(frame)
+                else:
+                    await websocket.send_text(frame)
+        except Exception as e:
+            logger.error("❌ Send error to %s: %s", user_id, e)
+            self.disconnect(user_id)
+    
+    async def _enqueue(self, user_id: str, frame: Union[str, bytes]):
+        """Ставит кадр в очередь отправки; при заполненной очереди ждёт, пока клиент её разберёт"""
+        state = self.users.get(user_id)
+        if state is not None:
+            await state.send_queue.put(frame)
+    
+    async def send_message(self, user_id: str, message: Union[dict, str]):
+        """Отправка сообщения пользователю (dict или заранее сериализованная строка)"""
+        # Кадр остаётся текстовым: бинарные кадры - только аудио
+        frame = message if isinstance(message, str) else orjson.dumps(message).decode()
+        await self._enqueue(user_id, frame)
+    
+    async def send_audio(self, user_id: str, audio_data: bytes, header: dict):
+        """Отправка аудио бинарным кадром (без base64) после управляющего JSON-кадра"""
+        await self.send_message(user_id, header)
+        await self._enqueue(user_id, audio_data)
     
     async def process_audio(self, user_id: str, audio_data: bytes):
         """Обработка аудио сообщения"""
-        print(f"🎬 Starting audio processing for {user_id}")
+        logger.debug("🎬 Starting audio processing for %s", user_id)
         try:
             # 1. STT - распознаем речь
-            print(f"🎧 Starting STT for {user_id}")
-            await self.send_message(user_id, {
-                "type": "status",
-                "message": "🎧 Recognizing speech..."
-            })
+            logger.debug("🎧 Starting STT for %s", user_id)
+            await self.send_message(user_id, RECOGNIZING_FRAME)
             
             user_text = await self.stt.transcribe_audio_bytes(audio_data)
-            print(f"🎧 STT result for {user_id}: '{user_text}'")
+            logger.debug("🎧 STT result for %s: '%s'", user_id, user_text)
             
             if not user_text.strip():
-                print(f"⚠️ Empty STT result for {user_id} - resuming timeout if paused")
+                logger.warning("⚠️ Empty STT result for %s - resuming timeout if paused", user_id)
                 await self.send_message(user_id, {
                     "type": "status",
                     "message": "🎧 Could not recognize speech, please try again"
@@ -463,7 +842,7 @@ CRITICAL: Keep response under 30 words. Be extremely brief and direct."""
             # Отменяем таймер ожидания только если получили реальный текст
             await self.cancel_response_timeout(user_id)
             
-            print(f"👤 User {user_id}: {user_text}")
+            logger.debug("👤 User %s: %s", user_id, user_text)
             
             await self.send_message(user_id, {
                 "type": "user_text",
@@ -471,150 +850,210 @@ CRITICAL: Keep response under 30 words. Be extremely brief and direct."""
             })
             
             # 2. LLM - генерируем ответ
-            print(f"🧠 Starting LLM for {user_id}")
-            await self.send_message(user_id, {
-                "type": "status",
-                "message": "🧠 Thinking about response..."
-            })
+            # Отдельный статус "Thinking" не шлём: клиент показывает его сам, получив user_text
+            logger.debug("🧠 Starting LLM for %s", user_id)
             
-            # Создаем расширенный системный промпт с CV и данными кандидата если есть
-            enhanced_prompt = self.system_prompt
-            if user_id in self.user_sessions:
-                session = self.user_sessions[user_id]
-                if session.get("cv_text") or session.get("candidate_info"):
-                    enhanced_prompt = f"""{self.system_prompt}
-
-CANDIDATE INFORMATION:"""
-                    
-                    if session.get("candidate_info"):
-                        candidate = session["candidate_info"]
-                        enhanced_prompt += f"""
-Name: {candidate.get('firstName', '')} {candidate.get('lastName', '')}
-Email: {candidate.get('email', '')}"""
-                    
-                    if session.get("cv_text"):
-                        enhanced_prompt += f"""
-
-CV CONTENT:
-{session['cv_text']}"""
-                    
-                    enhanced_prompt += """
-
-Use this information to conduct a personalized interview, asking relevant questions based on their CV and experience.
-
-CRITICAL: Keep response under 30 words. Be extremely brief and direct."""
-                
-                # Получаем персональный LLM клиент для пользователя
-                user_llm = self.get_user_llm_client(user_id)
-                bot_response, interview_ended = await user_llm.chat_completion(user_text, enhanced_prompt)
+            # Расширенный системный промпт собран один раз при загрузке CV
+            enhanced_prompt = self._enhanced_prompt_for(user_id)
             
-            print(f"🧠 LLM result for {user_id}: '{bot_response}'")
-            print(f"🤖 Bot to {user_id}: {bot_response}")
+            # Получаем персональный LLM клиент для пользователя
+            user_llm = self.get_user_llm_client(user_id)
             
-            # Проверяем, завершилось ли интервью
-            if interview_ended:
-                print(f"🎯 Interview ended for {user_id}")
-                await self._handle_interview_completion(user_id, bot_response)
-                return
+            # 3. TTS - озвучиваем ответ по предложениям, пока LLM генерирует остальное
+            bot_response, interview_ended = await self._stream_and_send_reply(user_id, user_llm, user_text, enhanced_prompt)
             
-            # 3. TTS - озвучиваем ответ (текст отправляется одновременно с первым аудио чанком)
-            print(f"🔊 Starting TTS for {user_id}")
-            await self.send_message(user_id, {
-                "type": "status",
-                "message": "🔊 Generating speech..."
-            })
+            state = self.users.get(user_id)
+            if state is not None:
+                state.session["conversation_history"].append({"role": "user", "content": user_text})
+                state.session["conversation_history"].append({"role": "assistant", "content": bot_response})
             
-            # Генерируем аудио чанками и отправляем
-            await self._synthesize_and_send_audio(user_id, bot_response)
+            logger.debug("🧠 LLM result for %s: '%s'", user_id, bot_response)
+            logger.debug("🤖 Bot to %s: %s", user_id, bot_response)
             
-            await self.send_message(user_id, {
-                "type": "completed",
-                "message": "✅ Ready for next question"
-            })
+            # Проверяем, завершилось ли интервью (финальная реплика уже озвучена)
+            if interview_ended:
+                logger.debug("🎯 Interview ended for %s", user_id)
+                await self._handle_interview_completion(user_id)
+                return
+            
+            await self.send_message(user_id, READY_FRAME)
             
             # НЕ запускаем таймер здесь - ждем уведомления о завершении воспроизведения
             # await self.start_response_timeout(user_id)
             
-            print(f"✅ Audio processing completed for {user_id}")
+            logger.debug("✅ Audio processing completed for %s", user_id)
             
         except Exception as e:
-            print(f"❌ Process error for {user_id}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error("❌ Process error for %s: %s", user_id, e, exc_info=logger.isEnabledFor(logging.DEBUG))
             await self.send_message(user_id, {
                 "type": "error",
                 "message": f"❌ Processing error: {str(e)}"
             })
     
+    async def _stream_and_send_reply(self, user_id: str, user_llm: OpenRouterClient, user_text: str,
+                                     system_prompt: str) -> tuple[str, bool]:
+        """
+        Стримит ответ LLM и запускает синтез каждого завершённого предложения, не дожидаясь конца генерации:
+        первый аудио чанк уходит клиенту вскоре после первого предложения. Чанки отправляются строго по порядку;
+        общее число чанков заранее неизвестно (total_chunks: null), его сообщает кадр audio_end.
+        Возвращает (полный текст ответа, флаг завершения интервью).
+        """
+        pending: asyncio.Queue = asyncio.Queue()  # (текст, задача синтеза) в порядке ответа; None - конец
+        tasks = []
+        
+        def synthesize(sentence: str):
+            # Длинное предложение делится как обычно; число одновременных запросов ограничено семафором AWSPollyTTS
+            for chunk in self.tts.split_text_into_chunks(sentence):
+                task = asyncio.create_task(self.tts.synthesize_chunk(chunk))
+                tasks.append(task)
+                pending.put_nowait((chunk, task))
+        
+        async def emit():
+            sent = 0
+            unsent = []  # Текст чанков, которые не удалось синтезировать, уходит с ближайшим аудио
+            while (item := await pending.get()) is not None:
+                text, task = item
+                audio_data = await task
+                if not audio_data:
+                    unsent.append(text)
+                    continue
+                # Первый фрагмент текста открывает новую реплику у клиента, следующие дописываются в неё
+                await self.send_message(user_id, {
+                    "type": "bot_text" if sent == 0 else "bot_text_append",
+                    "text": " ".join([*unsent, text])
+                })
+                unsent.clear()
+                await self.send_audio(user_id, audio_data, {
+                    "type": "audio_chunk",
+                    "chunk_index": sent,
+                    "total_chunks": None
+                })
+                sent += 1
+            if sent:
+                await self.send_message(user_id, {"type": "audio_end", "total_chunks": sent})
+        
+        emitter = asyncio.create_task(emit())
+        try:
+            parts = []
+            buffer = ""
+            async with aclosing(user_llm.stream_completion(user_text, system_prompt)) as deltas:
+                async for content in deltas:
+                    parts.append(content)
+                    # Ищем границу только в новом тексте (плюс символ перед ним - граница из двух символов)
+                    scan_from = max(0, len(buffer) - 1)
+                    buffer += content
+                    while match := _SENTENCE_END_RE.search(buffer, scan_from):
+                        sentence = buffer[:match.end()].strip()
+                        buffer = buffer[match.end():]
+                        scan_from = 0
+                        if sentence:
+                            synthesize(sentence)
+            # Остаток без завершающего пробела после знака препинания
+            if buffer.strip():
+                synthesize(buffer.strip())
+            pending.put_nowait(None)
+            await emitter
+            return "".join(parts), user_llm.is_interview_completed()
+        finally:
+            # Не оставляем висящих запросов к Polly после ошибки или отмены
+            emitter.cancel()
+            for task in tasks:
+                task.cancel()
+    
+    async def presynthesize_timeout_audio(self):
+        """Синтезирует все напоминания о таймауте один раз, чтобы не обращаться к Polly при каждом таймауте"""
+        async def synthesize(text: str):
+            audio_chunks = await asyncio.gather(
+                *(self.tts.synthesize_chunk(chunk) for chunk in self.tts.split_text_into_chunks(text))
+            )
+            # Кэшируем только полностью синтезированные напоминания
+            if all(audio_chunks):
+                self.timeout_audio_cache[text] = audio_chunks
+        
+        texts = [text for stage_texts in self.timeout_responses.values() for text in stage_texts]
+        try:
+            await asyncio.gather(*(synthesize(text) for text in texts))
+        except Exception as e:
+            logger.warning("⚠️ Timeout audio presynthesis failed: %s", e)
+        logger.info("🔊 Cached audio for %s/%s timeout reminders", len(self.timeout_audio_cache), len(texts))
+    
     async def _synthesize_and_send_audio(self, user_id: str, text: str, message_type: str = "bot_text"):
         """Синтез речи с отправкой чанков"""
+        tasks = []
         try:
-            # Разбиваем на чанки
-            chunks = self.tts.split_text_into_chunks(text)
-            
-            for i, chunk in enumerate(chunks):
-                # Синтезируем чанк
-                audio_data = await self.tts.synthesize_chunk(chunk)
+            cached = self.timeout_audio_cache.get(text)
+            if cached is None:
+                # Разбиваем на чанки
+                chunks = self.tts.split_text_into_chunks(text)
+                
+                # Синтезируем все чанки параллельно (число одновременных запросов к Polly
+                # ограничено семафором в AWSPollyTTS), а отправляем строго по порядку
+                tasks = [asyncio.create_task(self.tts.synthesize_chunk(chunk)) for chunk in chunks]
+            # Заранее синтезированное напоминание отправляем без обращения к Polly
+            sources = tasks if cached is None else cached
+            
+            text_sent = False
+            for i, source in enumerate(sources):
+                audio_data = source if isinstance(source, bytes) else await source
                 if audio_data:
-                    # Кодируем в base64
-                    audio_b64 = base64.b64encode(audio_data).decode('utf-8')
-                    
-                    # Если это первый чанк, отправляем текст и аудио одновременно
-                    if i == 0:
+                    # Текст отправляем вместе с первым готовым аудио чанком (даже если первый чанк не синтезировался)
+                    if not text_sent:
+                        text_sent = True
                         # Отправляем текстовое сообщение
                         if message_type == "bot_waiting":
                             await self.send_message(user_id, {
                                 "type": "bot_waiting",
                                 "text": text
                             })
-                            print(f"📝 Sending timeout text: '{text}'")
+                            logger.debug("📝 Sending timeout text: '%s'", text)
                         elif message_type == "interview_end":
                             await self.send_message(user_id, {
                                 "type": "bot_text",
                                 "text": text
                             })
-                            print(f"📝 Sending interview end text: '{text}'")
+                            logger.debug("📝 Sending interview end text: '%s'", text)
                         else:
                             await self.send_message(user_id, {
                                 "type": "bot_text",
                                 "text": text
                             })
-                            print(f"📝 Sending bot text: '{text}'")
+                            logger.debug("📝 Sending bot text: '%s'", text)
                     
-                    # Отправляем аудио чанк
-                    await self.send_message(user_id, {
+                    # Отправляем аудио чанк: JSON-заголовок и сразу за ним бинарный кадр с MP3
+                    await self.send_audio(user_id, audio_data, {
                         "type": "audio_chunk",
-                        "audio": audio_b64,
                         "chunk_index": i,
-                        "total_chunks": len(chunks)
+                        "total_chunks": len(sources)
                     })
                     
-                    # Небольшая задержка между чанками
-                    await asyncio.sleep(0.1)
-                    
         except Exception as e:
-            print(f"❌ TTS error for {user_id}: {e}")
+            logger.error("❌ TTS error for %s: %s", user_id, e)
             await self.send_message(user_id, {
                 "type": "error",
                 "message": "❌ Speech synthesis error"
             })
+        finally:
+            # Не оставляем висящих запросов к Polly после ошибки или отмены
+            for task in tasks:
+                task.cancel()
     
-    async def _handle_interview_completion(self, user_id: str, final_message: str):
-        """Обрабатывает завершение интервью"""
+    async def _handle_interview_completion(self, user_id: str, final_message: str = None):
+        """Обрабатывает завершение интервью (final_message=None - финальная реплика уже озвучена)"""
         try:
-            print(f"🎯 Handling interview completion for {user_id}")
+            logger.debug("🎯 Handling interview completion for %s", user_id)
             
             # Отменяем все активные таймеры
             await self.cancel_response_timeout(user_id)
             
-            # Отправляем статус завершения
-            await self.send_message(user_id, {
-                "type": "status",
-                "message": "🎯 Interview completed! Generating final message..."
-            })
-            
-            # Озвучиваем финальное сообщение
-            await self._synthesize_and_send_audio(user_id, final_message, "interview_end")
+            if final_message is not None:
+                # Отправляем статус завершения
+                await self.send_message(user_id, {
+                    "type": "status",
+                    "message": "🎯 Interview completed! Generating final message..."
+                })
+                
+                # Озвучиваем финальное сообщение
+                await self._synthesize_and_send_audio(user_id, final_message, "interview_end")
             
             # Отправляем уведомление о завершении интервью
             await self.send_message(user_id, {
@@ -622,15 +1061,15 @@ CRITICAL: Keep response under 30 words. Be extremely brief and direct."""
                 "message": "🎯 Interview has been completed successfully"
             })
             
-            print(f"✅ Interview completion handled for {user_id}")
+            logger.debug("✅ Interview completion handled for %s", user_id)
             
             # Автоматически отключаем пользователя через 3 секунды после завершения
             await asyncio.sleep(3.0)
-            print(f"🔚 Auto-disconnecting user {user_id} after interview completion")
-            self.disconnect(user_id)
+            logger.debug("🔚 Auto-disconnecting user %s after interview completion", user_id)
+            self.disconnect(user_id, graceful=True)
             
         except Exception as e:
-            print(f"❌ Error handling interview completion for {user_id}: {e}")
+            logger.error("❌ Error handling interview completion for %s: %s", user_id, e)
             await self.send_message(user_id, {
                 "type": "error",
                 "message": "❌ Error completing interview"
@@ -638,15 +1077,31 @@ CRITICAL: Keep response under 30 words. Be extremely brief and direct."""
     
     async def process_cv_upload(self, user_id: str, filename: str, base64_data: str, candidate_info: dict = None):
         """Обработка загрузки CV в PDF"""
-        print(f"📄 Processing CV upload for {user_id}: {filename}")
+        logger.debug("📄 Processing CV upload for %s: %s", user_id, filename)
         
         try:
+            # Слишком большой файл отклоняем до декодирования (base64 длиннее данных в 4/3 раза)
+            if len(base64_data) * 3 // 4 > MAX_PDF_SIZE:
+                await self.send_message(user_id, {
+                    "type": "cv_error",
+                    "message": f"PDF is too large (max {MAX_PDF_SIZE // (1024 * 1024)}MB)"
+                })
+                return
+            
             # Декодируем base64 данные
-            pdf_data = base64.b64decode(base64_data)
-            print(f"📄 PDF size: {len(pdf_data)} bytes")
+            loop = asyncio.get_running_loop()
+            pdf_data = await loop.run_in_executor(self.cv_executor, base64.b64decode, base64_data)
+            logger.debug("📄 PDF size: %s bytes", len(pdf_data))
             
             # Извлекаем текст из PDF
-            cv_text = self._extract_pdf_text(pdf_data)
+            try:
+                cv_text = await self.extract_pdf_text(pdf_data)
+            except CvTooLongError as e:
+                await self.send_message(user_id, {
+                    "type": "cv_error",
+                    "message": str(e)
+                })
+                return
             
             if not cv_text:
                 await self.send_message(user_id, {
@@ -656,15 +1111,17 @@ CRITICAL: Keep response under 30 words. Be extremely brief and direct."""
                 return
             
             # Сохраняем CV и данные кандидата в сессии пользователя
-            if user_id in self.user_sessions:
-                self.user_sessions[user_id]["cv_text"] = cv_text
-                self.user_sessions[user_id]["candidate_info"] = candidate_info
+            state = self.users.get(user_id)
+            if state is not None:
+                state.session["cv_text"] = cv_text
+                state.session["candidate_info"] = candidate_info
+                state.enhanced_prompt = self._build_enhanced_prompt(candidate_info, cv_text)
             
-            print(f"📄 CV extracted for {user_id}: {len(cv_text)} characters")
-            print(f"📄 CV preview: {cv_text[:200]}...")
+            logger.debug("📄 CV extracted for %s: %s characters", user_id, len(cv_text))
+            logger.debug("📄 CV preview: %s...", cv_text[:200])
             
             if candidate_info:
-                print(f"👤 Candidate: {candidate_info.get('firstName')} {candidate_info.get('lastName')} ({candidate_info.get('email')})")
+                logger.debug("👤 Candidate: %s %s (%s)", candidate_info.get('firstName'), candidate_info.get('lastName'), candidate_info.get('email'))
             
             await self.send_message(user_id, {
                 "type": "cv_uploaded",
@@ -672,9 +1129,7 @@ CRITICAL: Keep response under 30 words. Be extremely brief and direct."""
             })
             
         except Exception as e:
-            print(f"❌ CV processing failed for {user_id}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error("❌ CV processing failed for %s: %s", user_id, e, exc_info=logger.isEnabledFor(logging.DEBUG))
             await self.send_message(user_id, {
                 "type": "cv_error",
                 "message": "Error processing CV"
@@ -682,6 +1137,29 @@ CRITICAL: Keep response under 30 words. Be extremely brief and direct."""
 
 # Создаем глобальный экземпляр
 voice_bot = VoiceBotWebSocket()
+# Системный промпт и разбиение текста TTS не меняются после запуска - связываем один раз для эндпоинтов
+SYSTEM_PROMPT = voice_bot.system_prompt
+split_text_into_chunks = voice_bot.tts.split_text_into_chunks
+
+@app.on_event("startup")
+async def startup():
+    """Создаёт каталог static, запускает фоновую очистку CV сессий и синтез напоминаний о таймауте"""
+    if not os.path.isdir(STATIC_DIR):
+        os.makedirs(STATIC_DIR)
+    app.state.cv_reaper = asyncio.create_task(voice_bot.reap_cv_sessions())
+    app.state.timeout_audio_warmup = asyncio.create_task(voice_bot.presynthesize_timeout_audio())
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Закрывает соединения с внешними сервисами"""
+    app.state.cv_reaper.cancel()
+    app.state.timeout_audio_warmup.cancel()
+    if voice_bot.redis is not None:
+        await voice_bot.redis.aclose()
+    await voice_bot.tts.aclose()
+    await close_openrouter_client()
+    voice_bot.cv_executor.shutdown(wait=False)
+    voice_bot.cv_process_pool.shutdown(wait=False, cancel_futures=True)
 
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
@@ -694,78 +1172,86 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
     
     try:
         while True:
-            # Получаем сообщение от клиента
-            message = await websocket.receive_text()
-            data = json.loads(message)
+            # Получаем сообщение от клиента: бинарный кадр - это запись голоса, текстовый - JSON
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
             # Проверяем, что пользователь все еще подключен
-            if user_id not in voice_bot.active_connections:
-                print(f"⚠️ Ignoring message from disconnected user {user_id}")
+            if user_id not in voice_bot.users:
+                logger.warning("⚠️ Ignoring message from disconnected user %s", user_id)
                 break
             
-            print(f"📨 Received message from {user_id}: type={data.get('type')}")
+            if message.get("bytes") is not None:
+                audio_data = message["bytes"]
+                logger.debug("🎵 Processing audio from %s, size: %s bytes", user_id, len(audio_data))
+                await voice_bot.process_audio(user_id, audio_data)
+                continue
             
-            if data["type"] == "audio":
-                print(f"🎵 Processing audio from {user_id}, size: {len(data['audio'])} chars")
-                # Декодируем аудио из base64
+            # Пинги проверяем сравнением строки до разбора JSON
+            text = message["text"]
+            if text in PING_FRAMES:
+                await voice_bot.send_message(user_id, PONG_FRAME)
+                continue
+            
+            try:
+                data = orjson.loads(text)
+            except orjson.JSONDecodeError:
+                logger.warning("⚠️ Ignoring malformed message from %s", user_id)
+                continue
+            if not isinstance(data, dict):
+                # Корректный JSON, но не объект ([], 1, "x") - пропускаем так же, как битый
+                logger.warning("⚠️ Ignoring non-object message from %s", user_id)
+                continue
+            message_type = data.get("type")
+            logger.debug("📨 Received message from %s: type=%s", user_id, message_type)
+            
+            if message_type == "audio":
+                # Старый формат клиента: запись в base64 внутри JSON (новый клиент шлёт бинарный кадр)
                 try:
-                    audio_data = base64.b64decode(data["audio"])
-                    print(f"🔓 Decoded audio: {len(audio_data)} bytes")
-                    await voice_bot.process_audio(user_id, audio_data)
+                    loop = asyncio.get_running_loop()
+                    audio_data = await loop.run_in_executor(voice_bot.cv_executor, base64.b64decode, data["audio"])
+                    logger.debug("🔓 Decoded legacy base64 audio from %s: %s bytes", user_id, len(audio_data))
                 except Exception as e:
-                    print(f"❌ Audio decode error: {e}")
+                    logger.error("❌ Audio decode error: %s", e)
                     await voice_bot.send_message(user_id, {
                         "type": "error",
                         "message": f"❌ Ошибка декодирования аудио: {str(e)}"
                     })
+                    continue
+                await voice_bot.process_audio(user_id, audio_data)
                 
-
-                
-            elif data["type"] == "ping":
-                await voice_bot.send_message(user_id, {"type": "pong"})
+            elif message_type == "ping":
+                await voice_bot.send_message(user_id, PONG_FRAME)
                 
-            elif data["type"] == "voice_start":
-                print(f"🎤 Voice start detected for {user_id}, pausing timeout timer")
+            elif message_type == "voice_start":
+                logger.debug("🎤 Voice start detected for %s, pausing timeout timer", user_id)
                 # Приостанавливаем таймер таймаута когда пользователь начинает говорить
                 await voice_bot.pause_response_timeout(user_id)
                 
-            elif data["type"] == "finish_interview":
-                print(f"🔚 Manual interview finish requested by {user_id}")
+            elif message_type == "finish_interview":
+                logger.debug("🔚 Manual interview finish requested by %s", user_id)
                 # Принудительно завершаем интервью
                 final_message = "Thank you for completing the screening interview. Our recruitment team will be in touch soon to discuss the next steps. Enjoy the rest of your day!"
                 await voice_bot._handle_interview_completion(user_id, final_message)
                 
-            elif data["type"] == "audio_playback_complete":
-                print(f"🔊 Audio playback completed for {user_id}")
+            elif message_type == "audio_playback_complete":
+                logger.debug("🔊 Audio playback completed for %s", user_id)
                 
-                # Если таймер был активен (timeout сообщение закончилось)
-                if voice_bot.user_timeout_active.get(user_id, False):
-                    current_stage = voice_bot.user_timeout_stage.get(user_id, 1)
-                    print(f"🔊 Timeout message playback completed for {user_id}, stage {current_stage-1}")
-                    
-                    # Если это была третья стадия (завершение интервью), не запускаем новый таймер
-                    if current_stage > 3:
-                        print(f"🔚 Interview ended for {user_id}, not starting new timeout")
-                        return
-                    
-                    # Сбрасываем флаг активного таймера
-                    voice_bot.user_timeout_active[user_id] = False
-                    
-                    # Запускаем следующую стадию таймера
-                    print(f"🔊 Starting timeout stage {current_stage} for {user_id}")
-                    voice_bot.user_timeout_tasks[user_id] = asyncio.create_task(
-                        voice_bot._timeout_handler(user_id)
-                    )
-                    voice_bot.user_timeout_active[user_id] = True
+                # Если таймер был активен (timeout сообщение закончилось) - следующая стадия,
+                # иначе обычное завершение воспроизведения ответа - запускаем таймер
+                state = voice_bot.users.get(user_id)
+                if state is not None and state.timeout_active:
+                    logger.debug("🔊 Timeout message playback completed for %s", user_id)
+                    voice_bot.timeout_playback_complete(user_id)
                 else:
-                    # Обычное завершение воспроизведения (не timeout сообщение)
-                    print(f"🔊 Starting new timeout for {user_id}")
+                    logger.debug("🔊 Starting new timeout for %s", user_id)
                     await voice_bot.start_response_timeout(user_id)
                 
     except WebSocketDisconnect:
         voice_bot.disconnect(user_id)
     except Exception as e:
-        print(f"❌ WebSocket error: {e}")
+        logger.error("❌ WebSocket error: %s", e)
         voice_bot.disconnect(user_id)
 
 @app.post("/upload-cv")
@@ -783,117 +1269,258 @@ async def upload_cv(
             "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         ]
         if cv_file.content_type not in allowed_types:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=400,
                 content={"error": "Only PDF and DOCX files are allowed"}
             )
         
-        # Проверяем размер файла (10MB)
-        contents = await cv_file.read()
-        if len(contents) > 10 * 1024 * 1024:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "File size must be less than 10MB"}
-            )
+        # Чтение и разбор CV ограничены по времени: зависший файл не держит запрос бесконечно
+        async with asyncio.timeout(CV_UPLOAD_TIMEOUT):
+            # Starlette уже принял файл во временный SpooledTemporaryFile (небольшие - в памяти, большие - на диске).
+            # Если размер известен, лимит (10MB) проверяем без чтения, а файл читаем одним вызовом без промежуточного буфера
+            max_size = 10 * 1024 * 1024
+            if cv_file.size is not None:
+                if cv_file.size > max_size:
+                    return ORJSONResponse(status_code=413, content=FILE_TOO_LARGE_ERROR)
+                contents = await cv_file.read()
+            else:
+                # Размер неизвестен - читаем блоками по 64KB и прерываемся, как только превышен лимит
+                buffer = bytearray()
+                while chunk := await cv_file.read(65536):
+                    buffer.extend(chunk)
+                    if len(buffer) > max_size:
+                        return ORJSONResponse(status_code=413, content=FILE_TOO_LARGE_ERROR)
+                contents = bytes(buffer)
         
-        # Извлекаем текст в зависимости от типа файла
-        if cv_file.content_type == "application/pdf":
-            cv_text = voice_bot._extract_pdf_text(contents)
-            file_type = "PDF"
-        elif cv_file.content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            cv_text = voice_bot._extract_docx_text(contents)
-            file_type = "DOCX"
-        else:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "Unsupported file type"}
-            )
+            # Извлекаем текст в зависимости от типа файла (в пулах потоков/процессов, не блокируя цикл событий)
+            if cv_file.content_type == "application/pdf":
+                try:
+                    cv_text = await voice_bot.extract_pdf_text(contents)
+                except CvTooLongError as e:
+                    return ORJSONResponse(
+                        status_code=400,
+                        content={"error": str(e)}
+                    )
+                file_type = "PDF"
+            elif cv_file.content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+                cv_text = await voice_bot.extract_docx_text(contents)
+                file_type = "DOCX"
+            else:
+                return ORJSONResponse(
+                    status_code=400,
+                    content={"error": "Unsupported file type"}
+                )
         
         if not cv_text:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=400,
                 content={"error": f"Could not extract text from {file_type} file"}
             )
         
         # Генерируем уникальный ID для сессии
-        session_id = f"session_{int(time.time())}_{hash(email)}"
+        session_id = secrets.token_hex(16)
         
         # Сохраняем данные в временном хранилище
-        voice_bot.cv_sessions[session_id] = {
-            "candidate_info": {
-                "firstName": first_name,
-                "lastName": last_name,
-                "email": email
-            },
+        candidate_info = {
+            "firstName": first_name,
+            "lastName": last_name,
+            "email": email
+        }
+        await voice_bot.store_cv_session(session_id, {
+            "candidate_info": candidate_info,
             "cv_text": cv_text,
+            "enhanced_prompt": voice_bot._build_enhanced_prompt(candidate_info, cv_text),
             "uploaded_at": time.time()
-        }
+        })
         
-        print(f"📄 CV uploaded for {first_name} {last_name} ({email})")
-        print(f"📄 Session ID: {session_id}")
-        print(f"📄 CV length: {len(cv_text)} characters")
+        cv_length = len(cv_text)
+        logger.info("📄 CV uploaded for %s %s (%s)", first_name, last_name, email)
+        logger.info("📄 Session ID: %s", session_id)
+        logger.info("📄 CV length: %s characters", cv_length)
         
-        return JSONResponse(content={
+        # Клиенту нужны только session_id и данные кандидата; длину CV отдаём числом вместо готовой фразы
+        return ORJSONResponse(content={
             "success": True,
             "session_id": session_id,
-            "message": f"CV uploaded successfully ({len(cv_text)} characters)",
-            "candidate": {
-                "firstName": first_name,
-                "lastName": last_name,
-                "email": email
-            }
+            "cv_length": cv_length,
+            "candidate": candidate_info
         })
         
-    except Exception as e:
-        print(f"❌ CV upload error: {e}")
-        import traceback
-        traceback.print_exc()
-        return JSONResponse(
-            status_code=500,
-            content={"error": "Server error processing CV"}
+    except TimeoutError:
+        logger.warning("⏰ CV upload timed out after %ss", CV_UPLOAD_TIMEOUT)
+        return ORJSONResponse(
+            status_code=504,
+            content={"error": "CV processing took too long"}
         )
 
+# Главная страница читается с диска один раз; браузер повторно проверяет её по ETag
+INDEX_PATH = os.path.join(STATIC_DIR, "index.html")
+INDEX_CACHE_CONTROL = "public, max-age=60"
+_index_page: Dict[str, Union[bytes, str]] = {}
+
+def _load_index_page() -> Dict[str, Union[bytes, str]]:
+    """Содержимое и ETag главной страницы (загружаются при первом запросе)"""
+    if not _index_page:
+        with open(INDEX_PATH, "rb") as f:
+            body = f.read()
+        _index_page["body"] = body
+        _index_page["etag"] = f'"{hashlib.md5(body).hexdigest()}"'
+    return _index_page
+
 @app.get("/")
-async def get_index():
+async def get_index(request: Request):
     """Главная страница"""
-    return FileResponse("static/index.html")
+    page = _load_index_page()
+    headers = {"Cache-Control": INDEX_CACHE_CONTROL, "ETag": page["etag"]}
+    if request.headers.get("if-none-match") == page["etag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=page["body"], media_type="text/html", headers=headers)
 
-@app.get("/health")
+# Проба живости: пробам достаточно статуса 2xx, поэтому тело - готовые байты без JSON
+HEALTH_BODY = b"OK"
+
+# Результат /test-components живёт 30 секунд: каждый вызов - платный запрос к LLM
+COMPONENT_TEST_TTL = 30
+_component_test_cache: Dict[str, dict] = TTLCache(maxsize=1, ttl=COMPONENT_TEST_TTL)
+_component_test_lock = asyncio.Lock()
+# Последний успешный результат - отдаём его, если внешний сервис сейчас недоступен
+_last_good_component_test: Dict[str, dict] = {}
+# Предел ожидания ответа LLM в /test-components (сек)
+COMPONENT_TEST_LLM_TIMEOUT = 5.0
+# Один LLM клиент на все прогоны тестов (создаётся при первом прогоне, уже внутри цикла событий)
+_llm_test_client: Optional[OpenRouterClient] = None
+
+class HealthCheckFastPath:
+    """
+    ASGI middleware: отвечает на GET/HEAD /health сразу, до CORS, GZip и роутера FastAPI -
+    пробы балансировщика не проходят весь стек обработки запроса.
+    """
+    _HEADERS = [
+        (b"content-type", b"text/plain; charset=utf-8"),
+        (b"content-length", str(len(HEALTH_BODY)).encode()),
+    ]
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/health" and scope["method"] in ("GET", "HEAD"):
+            await send({"type": "http.response.start", "status": 200, "headers": self._HEADERS})
+            await send({"type": "http.response.body", "body": HEALTH_BODY if scope["method"] == "GET" else b""})
+            return
+        await self.app(scope, receive, send)
+
+# Добавлена последней - значит, внешняя в стеке middleware
+app.add_middleware(HealthCheckFastPath)
+
+@app.get("/health", response_class=PlainTextResponse)
 async def health_check():
     """Проверка здоровья сервиса"""
-    return {"status": "OK", "message": "Voice Bot API is running"}
+    return PlainTextResponse(content=HEALTH_BODY)
 
 @app.get("/test-components")
 async def test_components():
-    """Тест всех компонентов API"""
-    results = {}
-    
-    try:
-        # Тест STT (с заглушкой)
-        results["stt"] = "✅ STT component initialized"
-        
-        # Тест LLM
-        test_llm = OpenRouterClient()
-        test_response = await test_llm.chat_completion("Say hello", voice_bot.system_prompt)
-        results["llm"] = f"✅ LLM response: {test_response[:50]}..."
+    """Тест всех компонентов API (результат кэшируется на COMPONENT_TEST_TTL секунд)"""
+    # Одновременные запросы ждут один прогон тестов вместо параллельных запросов к LLM
+    async with _component_test_lock:
+        results = _component_test_cache.get("results")
+        if results is not None:
+            return results
         
-        # Тест TTS
-        chunks = voice_bot.tts.split_text_into_chunks("Hello world")
-        results["tts"] = f"✅ TTS chunks: {len(chunks)}"
+        results = await _run_component_tests()
+        if "error" not in results:
+            _last_good_component_test["results"] = results
+        elif "results" in _last_good_component_test:
+            results = {**_last_good_component_test["results"], "stale": True, "error": results["error"]}
         
-    except Exception as e:
-        results["error"] = f"❌ Component test failed: {str(e)}"
+        # Неудачный прогон тоже кэшируем, чтобы не повторять его на каждый запрос
+        _component_test_cache["results"] = results
+        return results
+
+async def _test_stt() -> str:
+    """Тест STT (с заглушкой)"""
+    return "✅ STT component initialized"
+
+async def _test_llm() -> str:
+    """Тест LLM: короткий запрос к OpenRouter"""
+    global _llm_test_client
+    if _llm_test_client is None:
+        _llm_test_client = OpenRouterClient()
+    try:
+        # Зависший OpenRouter не должен задерживать весь ответ эндпоинта; мимо кэша ответов,
+        # чтобы проверка каждый раз доходила до API
+        async with asyncio.timeout(COMPONENT_TEST_LLM_TIMEOUT):
+            test_response, _ = await _llm_test_client.chat_completion("Say hello", SYSTEM_PROMPT, use_cache=False)
+    finally:
+        # Каждый прогон начинается с пустой истории
+        _llm_test_client.clear_history()
+    return f"✅ LLM response: {test_response[:50]}..."
+
+async def _test_tts() -> str:
+    """Тест TTS: разбиение текста на чанки"""
+    chunks = split_text_into_chunks("Hello world")
+    return f"✅ TTS chunks: {len(chunks)}"
+
+async def _run_component_tests() -> dict:
+    """Прогоняет тесты STT, LLM и TTS параллельно: время прогона - самый долгий тест, а не их сумма"""
+    names = ("stt", "llm", "tts")
+    outcomes = await asyncio.gather(_test_stt(), _test_llm(), _test_tts(), return_exceptions=True)
     
+    results = {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, BaseException):
+            if isinstance(outcome, TimeoutError):
+                outcome = f"{name.upper()} timed out after {COMPONENT_TEST_LLM_TIMEOUT}s"
+            results.setdefault("error", f"❌ Component test failed: {str(outcome)}")
+        else:
+            results[name] = outcome
     return results
 
 if __name__ == "__main__":
-    # Создаем папку static если её нет
-    os.makedirs("static", exist_ok=True)
+    # uvloop и httptools (uvicorn[standard]) - быстрее цикл событий и разбор HTTP;
+    # на Windows uvloop недоступен, там остаёмся на стандартном asyncio
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    # Реализация WebSocket по websockets (C-ускоренный разбор кадров) вместо автовыбора
+    ws = "websockets" if importlib.util.find_spec("websockets") else "auto"
+    logger.info("🚀 Event loop: %s, HTTP parser: %s, WebSocket: %s", loop, http, ws)
     
+    # Автоперезагрузка только для разработки (DEV_RELOAD=1); число воркеров - см. _web_workers
+    reload = bool(int(os.getenv("DEV_RELOAD", "0")))
+    workers = _web_workers()
+    # Журнал доступа uvicorn пишет строку на каждый запрос; включается ACCESS_LOG=1
+    access_log = bool(int(os.getenv("ACCESS_LOG", "0")))
+    
+    # HTTP/2 (загрузка CV и WebSocket в одном TCP соединении) требует TLS с ALPN, а uvicorn умеет только HTTP/1.1.
+    # При заданных TLS_CERTFILE и TLS_KEYFILE и установленном hypercorn запускаемся через hypercorn
+    certfile = os.getenv("TLS_CERTFILE")
+    keyfile = os.getenv("TLS_KEYFILE")
+    if certfile and keyfile and not reload and importlib.util.find_spec("hypercorn"):
+        from hypercorn.config import Config
+        from hypercorn.run import run
+        
+        config = Config()
+        config.application_path = "websocket_api:app"
+        config.bind = ["0.0.0.0:8800"]
+        config.certfile = certfile
+        config.keyfile = keyfile
+        config.alpn_protocols = ["h2", "http/1.1"]
+        config.workers = workers
+        config.worker_class = "uvloop" if loop == "uvloop" else "asyncio"
+        config.accesslog = "-" if access_log else None
+        logger.info("🚀 Serving HTTP/2 over TLS with hypercorn (%s workers)", workers)
+        sys.exit(run(config))
     
     uvicorn.run(
         "websocket_api:app",
         host="0.0.0.0",
         port=8800,
-        reload=True,
+        reload=reload,
+        workers=workers,
+        access_log=access_log,
+        loop=loop,
+        http=http,
+        ws=ws,
+        ssl_certfile=certfile if certfile and keyfile else None,
+        ssl_keyfile=keyfile if certfile and keyfile else None,
     ) 
\ No newline at end of file